@@ -1,13 +1,20 @@
 import base64
 import hashlib
+import itertools
 import os
+import threading
 import time
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Tuple
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
+import numpy as np
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
 
+from perceptual_hash import MultiIndexHash
+from vector_index import VectorIndex, quantize_embedding
+
 
 def _get_mongo_client() -> MongoClient:
 	"""Create and return a cached MongoDB client using MONGODB_URI env var."""
@@ -25,6 +32,23 @@ def _get_mongo_client() -> MongoClient:
 _client = None
 _db_name = os.getenv("MONGODB_DB", "dlba")
 _col_name = os.getenv("MONGODB_COLLECTION", "predictions")
+_indexes_ready = False
+
+# Near-duplicate matching on perceptual hash; a negative distance disables it
+_PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "4"))
+_phash_index: Optional[MultiIndexHash] = None
+_phash_index_lock = threading.Lock()
+
+# Similarity search over int8 embeddings of unique images
+_EMBEDDING_INDEX_PATH = Path(os.getenv("EMBEDDING_INDEX_PATH", str(Path(__file__).parent / "indexes" / "embeddings.npz")))
+_EMBEDDING_EXACT_THRESHOLD = int(os.getenv("EMBEDDING_EXACT_THRESHOLD", "20000"))
+_EMBEDDING_NPROBE = int(os.getenv("EMBEDDING_NPROBE", "8"))
+_EMBEDDING_SAVE_EVERY = int(os.getenv("EMBEDDING_SAVE_EVERY", "500"))
+_vector_index: Optional[VectorIndex] = None
+_vector_index_lock = threading.Lock()
+_vector_index_saving = threading.Lock()
+_vector_index_dirty = False
+_unsaved_embeddings = 0
 
 
 def _ensure_connection():
@@ -48,40 +72,226 @@ def _ensure_connection():
 
 def _get_collection():
 	"""Get collection with connection retry."""
+	global _indexes_ready
 	client = _ensure_connection()
-	return client[_db_name][_col_name]
+	collection = client[_db_name][_col_name]
+	if not _indexes_ready:
+		# Lookups used by duplicate checks, history, exports and retention
+		collection.create_index("image_hash")
+		collection.create_index("created_at")
+		collection.create_index("duplicate_of", sparse=True)
+		_indexes_ready = True
+	return collection
+
+
+def _calculate_image_hash(image_bytes: bytes | BinaryIO) -> str:
+	"""Calculate SHA256 hash of image bytes (or a binary file, in chunks) for duplicate detection."""
+	if isinstance(image_bytes, bytes):
+		return hashlib.sha256(image_bytes).hexdigest()
+	digest = hashlib.sha256()
+	image_bytes.seek(0)
+	for chunk in iter(lambda: image_bytes.read(64 * 1024), b""):
+		digest.update(chunk)
+	return digest.hexdigest()
+
+
+def _read_image_bytes(image_bytes: bytes | BinaryIO) -> bytes:
+	if isinstance(image_bytes, bytes):
+		return image_bytes
+	image_bytes.seek(0)
+	return image_bytes.read()
+
+
+def _get_phash_index(collection) -> Optional[MultiIndexHash]:
+	"""Return the in-process perceptual-hash index, loading it from MongoDB on first use.
+
+	Only records that hold the image blob are indexed; duplicates point at them anyway.
+	"""
+	global _phash_index
+	if _PHASH_MAX_DISTANCE < 0:
+		return None
+	if _phash_index is None:
+		with _phash_index_lock:
+			if _phash_index is None:
+				started = time.perf_counter()
+				index = MultiIndexHash(_PHASH_MAX_DISTANCE)
+				cursor = collection.find(
+					{"image_phash": {"$type": "string"}, "image_base64": {"$exists": True, "$ne": None}},
+					{"_id": 1, "image_phash": 1},
+				)
+				for doc in cursor:
+					index.add(str(doc["_id"]), doc["image_phash"])
+				_phash_index = index
+				print(f"[PHASH INDEX] Loaded {len(index)} hashes in {time.perf_counter() - started:.2f}s")
+	return _phash_index
+
+
+def _get_vector_index(collection, embedding_model: Optional[str] = None) -> VectorIndex:
+	"""Return the in-process embedding index, loading the on-disk snapshot on first use.
+
+	Records inserted after the snapshot (or all of them, without one) are read back
+	from MongoDB, so the snapshot is only a cache. The index holds the embeddings of
+	one model: given an embedding_model other than the loaded index's, it is rebuilt
+	from that model's records (plus older ones saved without a model name), so two
+	feature spaces of the same size are never mixed.
+	"""
+	global _vector_index
+	index = _vector_index
+	if index is not None and (embedding_model is None or index.model == embedding_model):
+		return index
+	with _vector_index_lock:
+		if _vector_index is not None and (embedding_model is None or _vector_index.model == embedding_model):
+			return _vector_index
+		if _vector_index is not None:
+			print(f"[VECTOR INDEX] Embedding model changed from {_vector_index.model} to {embedding_model}, rebuilding")
+		from bson import ObjectId
+		started = time.perf_counter()
+		index = None
+		if _EMBEDDING_INDEX_PATH.exists():
+			try:
+				index = VectorIndex.load(_EMBEDDING_INDEX_PATH, _EMBEDDING_EXACT_THRESHOLD, _EMBEDDING_NPROBE)
+			except Exception as e:
+				print(f"[VECTOR INDEX] Could not load {_EMBEDDING_INDEX_PATH}, rebuilding: {e}")
+			if index is not None and embedding_model is not None and index.model != embedding_model:
+				print(f"[VECTOR INDEX] Snapshot holds {index.model} embeddings, not {embedding_model}; rebuilding")
+				index = None
+		if index is None:
+			index = VectorIndex(_EMBEDDING_EXACT_THRESHOLD, _EMBEDDING_NPROBE, model=embedding_model)
+		query: Dict[str, Any] = {"embedding": {"$exists": True}}
+		if index.model is not None:
+			query["embedding_model"] = {"$in": [index.model, None]}
+		if index.last_id:
+			query["_id"] = {"$gt": ObjectId(index.last_id)}
+		for doc in collection.find(query, {"_id": 1, "embedding": 1}).sort("_id", 1):
+			try:
+				index.add(str(doc["_id"]), np.frombuffer(doc["embedding"], dtype=np.int8))
+			except ValueError as e:
+				# Embedding from a different model than the rest of the index
+				print(f"[VECTOR INDEX] Skipping {doc['_id']}: {e}")
+		_vector_index = index
+		print(f"[VECTOR INDEX] Loaded {len(index)} {index.model or ''} embeddings in {time.perf_counter() - started:.2f}s")
+	return _vector_index
+
+
+def _save_vector_index_in_background() -> None:
+	"""Save the snapshot on a thread; a request made while a save runs triggers one more."""
+	global _vector_index_dirty
+	_vector_index_dirty = True
+	if not _vector_index_saving.acquire(blocking=False):
+		return
+
+	def _run():
+		global _vector_index_dirty
+		while True:
+			try:
+				while _vector_index_dirty:
+					_vector_index_dirty = False
+					_vector_index.save(_EMBEDDING_INDEX_PATH)
+			except Exception as e:
+				print(f"[VECTOR INDEX] Could not save snapshot: {e}")
+			finally:
+				_vector_index_saving.release()
+			# Catch a request that arrived between the last check and the release
+			if not _vector_index_dirty or not _vector_index_saving.acquire(blocking=False):
+				return
+
+	threading.Thread(target=_run, daemon=True).start()
+
+
+def _invalidate_vector_snapshot() -> None:
+	"""Drop the on-disk snapshot after an embedding moved onto an existing record.
+
+	Loading only catches up on records newer than the snapshot's last _id, so
+	a promoted heir with an older _id would otherwise be missing after restart.
+	_forget_records writes a fresh snapshot once the removed records are gone.
+	"""
+	try:
+		_EMBEDDING_INDEX_PATH.unlink(missing_ok=True)
+	except OSError as e:
+		print(f"[VECTOR INDEX] Could not remove stale snapshot: {e}")
+
+
+def save_vector_index() -> None:
+	"""Write the embedding index snapshot to disk (called on shutdown)."""
+	if _vector_index is None:
+		return
+	with _vector_index_saving:
+		_vector_index.save(_EMBEDDING_INDEX_PATH)
+		print(f"[VECTOR INDEX] Saved {len(_vector_index)} embeddings to {_EMBEDDING_INDEX_PATH}")
+
+
+def _duplicate_info(doc: Dict[str, Any], match_type: str, distance: int) -> Dict[str, Any]:
+	return {
+		"id": str(doc.get("_id")),
+		"filename": doc.get("filename"),
+		"predicted_label": doc.get("predicted_label"),
+		"confidence": doc.get("confidence"),
+		"predicted_tag": doc.get("predicted_tag"),
+		"created_at": doc.get("created_at").isoformat() if doc.get("created_at") else None,
+		"match_type": match_type,
+		"distance": distance,
+	}
 
 
-def _calculate_image_hash(image_bytes: bytes) -> str:
-	"""Calculate SHA256 hash of image bytes for duplicate detection."""
-	return hashlib.sha256(image_bytes).hexdigest()
+def _find_near_duplicate(collection, image_phash: str) -> Optional[Dict[str, Any]]:
+	"""Find the closest stored image within PHASH_MAX_DISTANCE of image_phash."""
+	index = _get_phash_index(collection)
+	if index is None:
+		return None
+	match = index.nearest(image_phash)
+	if match is None:
+		return None
+	record_id, distance = match
+	from bson import ObjectId
+	original = collection.find_one({"_id": ObjectId(record_id)}, {"image_base64": 0})
+	if original is None:
+		# Deleted by another worker since the index was loaded
+		index.remove(record_id)
+		return None
+	return _duplicate_info(original, "near", distance)
 
 
-def check_duplicate(image_bytes: bytes) -> Optional[Dict[str, Any]]:
-	"""Check if an image with the same hash already exists in database.
+def _find_exact(collection, image_hash: str) -> Optional[Dict[str, Any]]:
+	"""Return a record with this SHA-256, preferring one that holds the image blob.
+
+	A near-duplicate record has its own image_hash but only references another
+	record's image, so it can be the first (or only) record for that hash.
+	"""
+	stored = collection.find_one(
+		{"image_hash": image_hash, "image_base64": {"$exists": True, "$ne": None}},
+		{"image_base64": 0},
+	)
+	return stored or collection.find_one({"image_hash": image_hash}, {"image_base64": 0})
+
+
+def check_duplicate(
+	image_bytes: bytes | BinaryIO | None = None,
+	image_phash: Optional[str] = None,
+	image_hash: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+	"""Check if the same or a visually near-identical image already exists in database.
 	
 	Args:
-		image_bytes: Raw image bytes
+		image_bytes: Raw image bytes or a binary file (unused if image_hash is given)
+		image_phash: Perceptual hash of the image; enables near-duplicate matching
+		image_hash: Precomputed SHA-256 of the image, e.g. from the streamed upload
 		
 	Returns:
-		Dict with existing prediction info if duplicate found, None otherwise
+		Dict with existing prediction info if duplicate found, None otherwise.
+		"match_type" is "exact" (same SHA-256) or "near" (perceptual hash within
+		PHASH_MAX_DISTANCE bits, given by "distance").
 	"""
 	try:
 		collection = _get_collection()
-		image_hash = _calculate_image_hash(image_bytes)
+		image_hash = image_hash or _calculate_image_hash(image_bytes)
 		
 		# Find existing prediction with same hash
-		existing = collection.find_one({"image_hash": image_hash})
+		existing = _find_exact(collection, image_hash)
 		
 		if existing:
-			return {
-				"id": str(existing.get("_id")),
-				"filename": existing.get("filename"),
-				"predicted_label": existing.get("predicted_label"),
-				"confidence": existing.get("confidence"),
-				"predicted_tag": existing.get("predicted_tag"),
-				"created_at": existing.get("created_at").isoformat() if existing.get("created_at") else None,
-			}
+			return _duplicate_info(existing, "exact", 0)
+		if image_phash:
+			return _find_near_duplicate(collection, image_phash)
 		return None
 	except Exception as e:
 		print(f"Error checking duplicate: {e}")
@@ -90,12 +300,17 @@ def check_duplicate(image_bytes: bytes) -> Optional[Dict[str, Any]]:
 
 def save_prediction(
 	filename: str,
-	image_bytes: bytes,
+	image_bytes: bytes | BinaryIO,
 	label: str,
 	confidence: float,
 	tag: str | None = None,
 	extra: Dict[str, Any] | None = None,
 	update_existing: bool = False,
+	image_phash: str | None = None,
+	near_duplicate: Dict[str, Any] | None = None,
+	embedding: np.ndarray | None = None,
+	image_hash: str | None = None,
+	embedding_model: str | None = None,
 ) -> Tuple[str, bool]:
 	"""Persist a prediction record along with input data.
 
@@ -104,21 +319,27 @@ def save_prediction(
 	
 	Args:
 		filename: Original filename
-		image_bytes: Raw image bytes
+		image_bytes: Raw image bytes or a binary file; only read when the image is stored
 		label: Predicted label
 		confidence: Prediction confidence
 		extra: Additional metadata
 		update_existing: If True and duplicate found, update existing record instead of creating new
+		image_phash: Perceptual hash stored with the record for near-duplicate lookups
+		near_duplicate: Result of check_duplicate with match_type "near"; the new record
+			then references that record's image instead of storing its own base64
+		embedding: Penultimate-layer features; stored int8-quantized for unique images only
+		image_hash: Precomputed SHA-256 of the image, e.g. from the streamed upload
+		embedding_model: Name of the model the embedding came from, stored next to it
 		
 	Returns:
 		Tuple of (prediction_id, is_new_record)
 	"""
 	try:
 		collection = _get_collection()
-		image_hash = _calculate_image_hash(image_bytes)
+		image_hash = image_hash or _calculate_image_hash(image_bytes)
 		
 		# Check for duplicate
-		existing = collection.find_one({"image_hash": image_hash})
+		existing = _find_exact(collection, image_hash)
 		
 		if existing and update_existing:
 			# Update existing record (không lưu lại base64)
@@ -129,6 +350,8 @@ def save_prediction(
 				"predicted_tag": tag,
 				"updated_at": datetime.now(timezone.utc),
 			}
+			if image_phash and not existing.get("image_phash"):
+				update_doc["image_phash"] = image_phash
 			if extra:
 				update_doc.update({"meta": extra})
 			
@@ -138,31 +361,56 @@ def save_prediction(
 			)
 			return (str(existing["_id"]), False)
 		
-		if existing:
+		if existing and not existing.get("image_missing"):
 			# Duplicate found but not updating - create new record without base64
 			# Reference to original record to save storage
 			print(f"[DUPLICATE DETECTED] Image hash {image_hash[:16]}... already exists. Creating record WITHOUT base64.")
+			# A near-duplicate match holds no image itself: reference the record it points at
+			original_id = existing.get("duplicate_of") or str(existing["_id"])
 			doc: Dict[str, Any] = {
 				"filename": filename,
 				"predicted_label": label,
 				"confidence": confidence,
 				"predicted_tag": tag,
 				"image_hash": image_hash,
-				"duplicate_of": str(existing["_id"]),  # Reference to original record
+				"image_phash": image_phash,
+				"duplicate_of": original_id,  # Reference to original record
 				"created_at": datetime.now(timezone.utc),
 			}
+			if existing.get("near_duplicate_distance") is not None:
+				doc["near_duplicate_distance"] = existing["near_duplicate_distance"]
 			if extra:
 				doc.update({"meta": extra})
 			# Không lưu image_base64 để tiết kiệm storage
 			# Chú ý: KHÔNG có trường "image_base64" trong doc này
 			
 			result = collection.insert_one(doc)
-			print(f"[DUPLICATE SAVED] New record {result.inserted_id} created WITHOUT base64, references {existing['_id']}")
+			print(f"[DUPLICATE SAVED] New record {result.inserted_id} created WITHOUT base64, references {original_id}")
+			return (str(result.inserted_id), True)
+		
+		if near_duplicate:
+			# Visually the same image re-encoded/resized - reuse the original's stored blob
+			print(f"[NEAR DUPLICATE DETECTED] Image is {near_duplicate['distance']} bits from {near_duplicate['id']}. Creating record WITHOUT base64.")
+			doc = {
+				"filename": filename,
+				"predicted_label": label,
+				"confidence": confidence,
+				"predicted_tag": tag,
+				"image_hash": image_hash,
+				"image_phash": image_phash,
+				"duplicate_of": near_duplicate["id"],
+				"near_duplicate_distance": near_duplicate["distance"],
+				"created_at": datetime.now(timezone.utc),
+			}
+			if extra:
+				doc.update({"meta": extra})
+			
+			result = collection.insert_one(doc)
 			return (str(result.inserted_id), True)
 		
 		# New unique image - save with base64
 		print(f"[NEW IMAGE] Image hash {image_hash[:16]}... is unique. Saving WITH base64.")
-		encoded_image = base64.b64encode(image_bytes).decode("utf-8")
+		encoded_image = base64.b64encode(_read_image_bytes(image_bytes)).decode("utf-8")
 		doc: Dict[str, Any] = {
 			"filename": filename,
 			"predicted_label": label,
@@ -170,19 +418,109 @@ def save_prediction(
 			"predicted_tag": tag,
 			"image_base64": encoded_image,
 			"image_hash": image_hash,
+			"image_phash": image_phash,
 			"created_at": datetime.now(timezone.utc),
 		}
 		if extra:
 			doc.update({"meta": extra})
+		quantized = quantize_embedding(embedding) if embedding is not None else None
+		if quantized is not None:
+			doc["embedding"] = quantized.tobytes()
+			doc["embedding_model"] = embedding_model
 
 		result = collection.insert_one(doc)
 		print(f"[NEW IMAGE SAVED] Record {result.inserted_id} created WITH base64")
+		if image_phash:
+			index = _get_phash_index(collection)
+			if index is not None:
+				index.add(str(result.inserted_id), image_phash)
+		if quantized is not None:
+			_add_embedding(collection, str(result.inserted_id), quantized, embedding_model)
 		return (str(result.inserted_id), True)
 	except Exception as e:
 		print(f"Error saving prediction: {e}")
 		raise
 
 
+def _add_embedding(collection, record_id: str, quantized: np.ndarray, embedding_model: Optional[str] = None) -> None:
+	global _unsaved_embeddings
+	try:
+		_get_vector_index(collection, embedding_model).add(record_id, quantized)
+	except Exception as e:
+		print(f"[VECTOR INDEX] Could not index embedding for {record_id}: {e}")
+		return
+	# Scheduler workers insert concurrently
+	with _vector_index_lock:
+		_unsaved_embeddings += 1
+		save = _unsaved_embeddings >= _EMBEDDING_SAVE_EVERY
+		if save:
+			_unsaved_embeddings = 0
+	if save:
+		_save_vector_index_in_background()
+
+
+def find_similar(prediction_id: str, limit: int = 10, embedding_model: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+	"""Return the stored images most similar to a prediction's image, most similar first.
+	
+	Duplicate records are resolved to the original image they reference. Only
+	embeddings from embedding_model (and untagged ones saved before model names
+	were recorded) are compared.
+	
+	Returns:
+		List of prediction summaries with a "similarity" (cosine) score, or None if the
+		prediction does not exist or has no embedding from embedding_model.
+	"""
+	from bson import ObjectId
+	collection = _get_collection()
+	try:
+		object_id = ObjectId(prediction_id)
+	except Exception:
+		return None
+	doc = collection.find_one({"_id": object_id}, {"embedding": 1, "embedding_model": 1, "duplicate_of": 1})
+	if doc is None:
+		return None
+	if doc.get("duplicate_of"):
+		object_id = ObjectId(doc["duplicate_of"])
+		doc = collection.find_one({"_id": object_id}, {"embedding": 1, "embedding_model": 1})
+		if doc is None:
+			return None
+	if embedding_model is not None and doc.get("embedding_model") not in (None, embedding_model):
+		return None
+	
+	index = _get_vector_index(collection, embedding_model)
+	vector = index.get(str(object_id))
+	if vector is None:
+		if not doc.get("embedding"):
+			return None
+		vector = np.frombuffer(doc["embedding"], dtype=np.int8)
+	
+	matches = [m for m in index.search(vector, limit + 1) if m[0] != str(object_id)][:limit]
+	docs = {
+		str(d["_id"]): d
+		for d in collection.find(
+			{"_id": {"$in": [ObjectId(record_id) for record_id, _ in matches]}},
+			{"image_base64": 0, "embedding": 0, "embedding_model": 0},
+		)
+	}
+	result = []
+	for record_id, similarity in matches:
+		match = docs.get(record_id)
+		if match is None:
+			# Deleted by another worker; drop it from this worker's index too
+			index.remove(record_id)
+			continue
+		result.append({
+			"id": record_id,
+			"filename": match.get("filename"),
+			"predicted_label": match.get("predicted_label"),
+			"confidence": match.get("confidence"),
+			"predicted_tag": match.get("predicted_tag"),
+			"created_at": match.get("created_at").isoformat() if match.get("created_at") else None,
+			"similarity": similarity,
+		})
+	return result
+
+
 def get_history(limit: int = 50) -> List[Dict[str, Any]]:
 	"""Return the most recent prediction records (including image_base64 for display).
 	
@@ -231,6 +569,62 @@ def get_history(limit: int = 50) -> List[Dict[str, Any]]:
 		return []
 
 
+def _prediction_filter(
+	start: Optional[datetime] = None,
+	end: Optional[datetime] = None,
+	labels: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+	query: Dict[str, Any] = {}
+	if start or end:
+		query["created_at"] = {}
+		if start:
+			query["created_at"]["$gte"] = start
+		if end:
+			query["created_at"]["$lt"] = end
+	if labels:
+		query["predicted_label"] = {"$in": labels}
+	return query
+
+
+def iter_predictions(
+	start: Optional[datetime] = None,
+	end: Optional[datetime] = None,
+	labels: Optional[List[str]] = None,
+	include_images: bool = False,
+	batch_size: int = 1000,
+) -> Iterator[Dict[str, Any]]:
+	"""Stream prediction records matching the filters, oldest first.
+
+	Documents are fetched from a server-side cursor batch_size at a time, and
+	the image and embedding blobs are projected out unless include_images is
+	set, so memory use does not depend on the size of the collection.
+
+	Args:
+		start: Only records created at or after this time
+		end: Only records created before this time
+		labels: Only records with one of these predicted labels
+		include_images: Also return image_base64 (large)
+		batch_size: Documents per cursor batch
+	"""
+	collection = _get_collection()
+	projection: Dict[str, int] = {"embedding": 0}
+	if not include_images:
+		projection["image_base64"] = 0
+	# _id order follows insertion time and needs no extra index or in-memory sort
+	cursor = (
+		collection
+		.find(_prediction_filter(start, end, labels), projection)
+		.sort("_id", 1)
+		.batch_size(batch_size)
+	)
+	try:
+		for doc in cursor:
+			doc["id"] = str(doc.pop("_id"))
+			yield doc
+	finally:
+		cursor.close()
+
+
 def get_analytics() -> Dict[str, Any]:
 	"""Get analytics data for dashboard.
 	
@@ -402,9 +796,276 @@ def delete_predictions(prediction_ids: List[str]) -> int:
 		if not object_ids:
 			return 0
 		
+		# Hand the images of deleted originals over to their surviving duplicates
+		originals = collection.find(
+			{"_id": {"$in": object_ids}, "image_base64": {"$exists": True, "$ne": None}},
+			{"image_base64": 1, "image_hash": 1, "image_phash": 1, "embedding": 1, "embedding_model": 1},
+		)
+		_release_originals(collection, originals, object_ids)
+		
 		# Delete documents
 		result = collection.delete_many({"_id": {"$in": object_ids}})
+		_forget_records(object_ids)
 		return result.deleted_count
 	except Exception as e:
 		print(f"Error deleting predictions: {e}")
-		raise
\ No newline at end of file
+		raise
+
+
+def _forget_records(object_ids: List[Any]) -> None:
+	"""Drop removed records from the in-process lookup indexes."""
+	for object_id in object_ids:
+		if _phash_index is not None:
+			_phash_index.remove(str(object_id))
+		if _vector_index is not None:
+			_vector_index.remove(str(object_id))
+	if _vector_index is not None and not _EMBEDDING_INDEX_PATH.exists():
+		_save_vector_index_in_background()
+
+
+def _release_originals(collection, originals: Iterable[Dict[str, Any]], removing: List[Any]) -> int:
+	"""Move each original's stored image onto one of its surviving duplicates.
+
+	Called before originals are removed. The promoted record (an exact duplicate
+	if there is one, else the oldest near duplicate) becomes the new original and
+	the remaining duplicates are re-pointed at it, so no record is left
+	referencing a missing image. A promoted near duplicate also takes over the
+	original's image_hash and image_phash, which describe the image it now holds.
+
+	Args:
+		originals: Records about to be removed, with image_base64, hashes and embedding
+		removing: ObjectIds of every record being removed
+
+	Returns:
+		Number of duplicates promoted
+	"""
+	removing_set = set(removing)
+	promoted = 0
+	moved_embedding = False
+	for original in originals:
+		survivors = [
+			doc for doc in collection.find(
+				{"duplicate_of": str(original["_id"])},
+				{"_id": 1, "image_hash": 1, "image_phash": 1, "near_duplicate_distance": 1},
+			)
+			if doc["_id"] not in removing_set
+		]
+		if not survivors:
+			continue
+		# Records with the original's SHA-256 first: they hold exactly the image being moved
+		survivors.sort(key=lambda doc: (
+			doc.get("image_hash") != original.get("image_hash"),
+			doc.get("near_duplicate_distance") is not None,
+			doc["_id"],
+		))
+		heir = survivors[0]
+		heir_id = str(heir["_id"])
+		promote: Dict[str, Any] = {"image_base64": original["image_base64"]}
+		heir_phash = heir.get("image_phash")
+		if heir.get("image_hash") != original.get("image_hash"):
+			# Keep exact-duplicate lookups (by SHA-256) and near lookups matching the stored image
+			promote["image_hash"] = original.get("image_hash")
+			promote["image_phash"] = heir_phash = original.get("image_phash")
+		if original.get("embedding") is not None:
+			promote["embedding"] = original["embedding"]
+			promote["embedding_model"] = original.get("embedding_model")
+		collection.update_one(
+			{"_id": heir["_id"]},
+			{"$set": promote, "$unset": {"duplicate_of": "", "near_duplicate_distance": ""}},
+		)
+		if len(survivors) > 1:
+			collection.update_many(
+				{"_id": {"$in": [doc["_id"] for doc in survivors[1:]]}},
+				{"$set": {"duplicate_of": heir_id}},
+			)
+		if _phash_index is not None and heir_phash:
+			_phash_index.remove(heir_id)
+			_phash_index.add(heir_id, heir_phash)
+		if original.get("embedding") is not None:
+			if _vector_index is not None and original.get("embedding_model") in (None, _vector_index.model):
+				_add_embedding(collection, heir_id, np.frombuffer(original["embedding"], dtype=np.int8))
+			moved_embedding = True
+		promoted += 1
+	if moved_embedding:
+		_invalidate_vector_snapshot()
+	return promoted
+
+
+def collection_size() -> Dict[str, int]:
+	"""Logical data size and allocated storage of the predictions collection, in bytes."""
+	collection = _get_collection()
+	stats = collection.database.command("collStats", collection.name)
+	return {
+		"documents": int(stats.get("count", 0)),
+		"data_bytes": int(stats.get("size", 0)),
+		"storage_bytes": int(stats.get("storageSize", 0)),
+	}
+
+
+def archive_predictions(
+	query: Dict[str, Any],
+	write_batch: Callable[[Iterable[Dict[str, Any]]], Any],
+	batch_size: int = 500,
+	limit: Optional[int] = None,
+) -> int:
+	"""Move records matching query out of MongoDB, oldest first.
+
+	Each batch of full documents (images included, _id as the string "id") is
+	passed to write_batch as an iterator over the cursor, so a batch is never
+	held in memory as a whole. write_batch must have stored the records durably
+	when it returns; only the records it consumed are then deleted. Images of
+	archived originals that still have live duplicates are handed over to
+	those duplicates first.
+
+	Args:
+		query: MongoDB filter selecting the records to archive
+		write_batch: Persists one batch; an exception stops the run before deletion
+		batch_size: Records per batch
+		limit: Stop after about this many records
+
+	Returns:
+		Number of records archived
+	"""
+	from bson import ObjectId
+	collection = _get_collection()
+	archived = 0
+	while limit is None or archived < limit:
+		size = batch_size if limit is None else min(batch_size, limit - archived)
+		cursor = collection.find(query).sort("_id", 1).limit(size).batch_size(min(size, 100))
+		first = next(cursor, None)
+		if first is None:
+			break
+		object_ids: List[Any] = []
+
+		def records() -> Iterator[Dict[str, Any]]:
+			for doc in itertools.chain([first], cursor):
+				object_ids.append(doc["_id"])
+				yield {"id": str(doc["_id"]), **{k: v for k, v in doc.items() if k != "_id"}}
+
+		try:
+			write_batch(records())
+		finally:
+			cursor.close()
+		if not object_ids:
+			break
+		# Only originals that live duplicates reference are read back, one image at a time
+		referenced = collection.distinct("duplicate_of", {"duplicate_of": {"$in": [str(object_id) for object_id in object_ids]}})
+		originals = collection.find(
+			{"_id": {"$in": [ObjectId(record_id) for record_id in referenced]}, "image_base64": {"$exists": True, "$ne": None}},
+			{"image_base64": 1, "image_hash": 1, "image_phash": 1, "embedding": 1, "embedding_model": 1},
+		).batch_size(1)
+		_release_originals(collection, originals, object_ids)
+		collection.delete_many({"_id": {"$in": object_ids}})
+		_forget_records(object_ids)
+		archived += len(object_ids)
+	return archived
+
+
+def _repoint_orphans(collection, batch_size: int) -> Dict[str, int]:
+	"""Fix duplicates whose duplicate_of no longer points at a stored image.
+
+	An orphan is re-pointed at another stored copy of the same image (same
+	SHA-256) when there is one; otherwise its dangling reference is removed
+	and it is marked image_missing.
+	"""
+	from bson import ObjectId
+	counts = {"orphans_repointed": 0, "orphans_unlinked": 0}
+	targets = collection.aggregate(
+		[
+			{"$match": {"duplicate_of": {"$type": "string"}}},
+			{"$group": {"_id": "$duplicate_of"}},
+		],
+		allowDiskUse=True,
+		batchSize=batch_size,
+	)
+
+	def resolve(target_ids: List[str]) -> None:
+		object_ids = []
+		for target_id in target_ids:
+			try:
+				object_ids.append(ObjectId(target_id))
+			except Exception:
+				pass
+		alive = {
+			str(doc["_id"])
+			for doc in collection.find({"_id": {"$in": object_ids}, "image_base64": {"$exists": True, "$ne": None}}, {"_id": 1})
+		}
+		for target_id in target_ids:
+			if target_id in alive:
+				continue
+			for orphan in collection.find({"duplicate_of": target_id}, {"_id": 1, "image_hash": 1}):
+				replacement = collection.find_one(
+					{"image_hash": orphan.get("image_hash"), "image_base64": {"$exists": True, "$ne": None}},
+					{"_id": 1},
+				) if orphan.get("image_hash") else None
+				if replacement is not None:
+					collection.update_one({"_id": orphan["_id"]}, {"$set": {"duplicate_of": str(replacement["_id"])}, "$unset": {"near_duplicate_distance": ""}})
+					counts["orphans_repointed"] += 1
+				else:
+					collection.update_one({"_id": orphan["_id"]}, {"$set": {"image_missing": True}, "$unset": {"duplicate_of": "", "near_duplicate_distance": ""}})
+					counts["orphans_unlinked"] += 1
+
+	pending: List[str] = []
+	for group in targets:
+		pending.append(group["_id"])
+		if len(pending) >= batch_size:
+			resolve(pending)
+			pending = []
+	if pending:
+		resolve(pending)
+	return counts
+
+
+def _deduplicate_images(collection, batch_size: int) -> Dict[str, int]:
+	"""Keep one stored copy per SHA-256; later copies become duplicates of the oldest.
+
+	Records saved before duplicate detection existed (or by concurrent uploads
+	of the same image) can each hold the same base64 blob.
+	"""
+	counts = {"images_deduplicated": 0, "image_bytes_removed": 0}
+	groups = collection.aggregate(
+		[
+			{"$match": {"image_base64": {"$exists": True, "$ne": None}, "image_hash": {"$type": "string"}}},
+			{"$group": {"_id": "$image_hash", "ids": {"$push": "$_id"}, "count": {"$sum": 1}, "image_bytes": {"$max": {"$strLenBytes": "$image_base64"}}}},
+			{"$match": {"count": {"$gt": 1}}},
+		],
+		allowDiskUse=True,
+		batchSize=batch_size,
+	)
+	for group in groups:
+		keep, *extra = sorted(group["ids"])
+		collection.update_many(
+			{"_id": {"$in": extra}},
+			{"$set": {"duplicate_of": str(keep)}, "$unset": {"image_base64": "", "embedding": "", "embedding_model": ""}},
+		)
+		collection.update_many({"duplicate_of": {"$in": [str(object_id) for object_id in extra]}}, {"$set": {"duplicate_of": str(keep)}})
+		_forget_records(extra)
+		counts["images_deduplicated"] += len(extra)
+		counts["image_bytes_removed"] += len(extra) * int(group["image_bytes"] or 0)
+	return counts
+
+
+def compact_predictions(batch_size: int = 1000, release_space: bool = False) -> Dict[str, Any]:
+	"""Repair duplicate references and drop redundant image copies.
+
+	Args:
+		batch_size: Records handled per query batch
+		release_space: Also run MongoDB's compact command so freed pages are
+			returned to the filesystem (blocks the collection on older servers)
+
+	Returns:
+		Counts of fixed records and the collection size before and after
+	"""
+	collection = _get_collection()
+	before = collection_size()
+	report: Dict[str, Any] = {}
+	report.update(_repoint_orphans(collection, batch_size))
+	report.update(_deduplicate_images(collection, batch_size))
+	if release_space:
+		collection.database.command("compact", collection.name)
+	after = collection_size()
+	report["before"] = before
+	report["after"] = after
+	report["reclaimed_data_bytes"] = max(0, before["data_bytes"] - after["data_bytes"])
+	report["reclaimed_storage_bytes"] = max(0, before["storage_bytes"] - after["storage_bytes"])
+	return report
\ No newline at end of file
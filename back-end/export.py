@@ -0,0 +1,235 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List
+
+# Records per cursor batch and per output chunk (CSV/NDJSON block or Parquet row group)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Output chunks are also cut at this many bytes, so exports with images stay bounded in memory
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(8 * 1024 * 1024)))
+# Archive row groups are also cut at this many bytes of strings/binary, since they carry images
+ARCHIVE_ROW_GROUP_BYTES = int(os.getenv("ARCHIVE_ROW_GROUP_BYTES", str(64 * 1024 * 1024)))
+
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+MEDIA_TYPES = {
+	"csv": "text/csv",
+	"jsonl": "application/x-ndjson",
+	"parquet": "application/vnd.apache.parquet",
+}
+
+# Exported columns, in order; image_base64 is appended when images are requested
+COLUMNS = [
+	"id",
+	"filename",
+	"predicted_label",
+	"confidence",
+	"predicted_tag",
+	"created_at",
+	"updated_at",
+	"image_hash",
+	"image_phash",
+	"duplicate_of",
+	"near_duplicate_distance",
+	"meta",
+]
+
+
+# Archives keep everything needed to restore a record; fields without a column go into "extra" as JSON
+ARCHIVE_COLUMNS = COLUMNS + ["image_missing", "image_base64", "embedding", "extra"]
+
+
+def _columns(include_images: bool) -> List[str]:
+	return COLUMNS + ["image_base64"] if include_images else COLUMNS
+
+
+def _flat_row(doc: Dict[str, Any], columns: List[str]) -> Dict[str, Any]:
+	"""Project a record onto the export columns; meta is JSON-encoded so every format stays flat."""
+	row = {column: doc.get(column) for column in columns}
+	if row["meta"] is not None:
+		row["meta"] = json.dumps(row["meta"], default=str)
+	if "extra" in row:
+		extra = {key: value for key, value in doc.items() if key not in row}
+		row["extra"] = json.dumps(extra, default=str) if extra else None
+	return row
+
+
+def _row_bytes(row: Dict[str, Any]) -> int:
+	return sum(len(value) for value in row.values() if isinstance(value, (str, bytes)))
+
+
+def _iso(value: Any) -> Any:
+	return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _csv_chunks(records: Iterable[Dict[str, Any]], columns: List[str], chunk_rows: int, chunk_bytes: int = 0) -> Iterator[bytes]:
+	buffer = io.StringIO()
+	writer = csv.DictWriter(buffer, fieldnames=columns)
+	writer.writeheader()
+	rows = 0
+	for doc in records:
+		row = _flat_row(doc, columns)
+		writer.writerow({k: _iso(v) for k, v in row.items()})
+		rows += 1
+		if rows >= chunk_rows or (chunk_bytes and buffer.tell() >= chunk_bytes):
+			yield buffer.getvalue().encode("utf-8")
+			buffer.seek(0)
+			buffer.truncate(0)
+			rows = 0
+	if buffer.tell():
+		yield buffer.getvalue().encode("utf-8")
+
+
+def _jsonl_chunks(records: Iterable[Dict[str, Any]], columns: List[str], chunk_rows: int, chunk_bytes: int = 0) -> Iterator[bytes]:
+	lines: List[str] = []
+	buffered = 0
+	for doc in records:
+		row = _flat_row(doc, columns)
+		lines.append(json.dumps({k: _iso(v) for k, v in row.items()}) + "\n")
+		buffered += len(lines[-1])
+		if len(lines) >= chunk_rows or (chunk_bytes and buffered >= chunk_bytes):
+			yield "".join(lines).encode("utf-8")
+			lines.clear()
+			buffered = 0
+	if lines:
+		yield "".join(lines).encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+	"""Write-only file that hands out what was written so far.
+
+	The Parquet footer stores absolute offsets, so tell() keeps counting
+	across drains.
+	"""
+
+	def __init__(self):
+		self._chunks: List[bytes] = []
+		self._position = 0
+
+	def writable(self) -> bool:
+		return True
+
+	def write(self, data) -> int:
+		data = bytes(data)
+		self._chunks.append(data)
+		self._position += len(data)
+		return len(data)
+
+	def tell(self) -> int:
+		return self._position
+
+	def drain(self) -> bytes:
+		data = b"".join(self._chunks)
+		self._chunks.clear()
+		return data
+
+
+def _parquet_schema(columns: List[str]):
+	import pyarrow as pa
+
+	types = {
+		"confidence": pa.float64(),
+		"created_at": pa.timestamp("us", tz="UTC"),
+		"updated_at": pa.timestamp("us", tz="UTC"),
+		"near_duplicate_distance": pa.int32(),
+		"image_missing": pa.bool_(),
+		"embedding": pa.binary(),
+	}
+	return pa.schema([(column, types.get(column, pa.string())) for column in columns])
+
+
+def _parquet_chunks(records: Iterable[Dict[str, Any]], columns: List[str], chunk_rows: int, chunk_bytes: int = 0) -> Iterator[bytes]:
+	"""One Parquet row group per chunk_rows records, emitted as soon as it is written.
+
+	With chunk_bytes, a row group is also closed once its string and binary
+	values reach that size, so large images do not pile up in memory.
+	"""
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+
+	schema = _parquet_schema(columns)
+	sink = _ChunkSink()
+	writer = pq.ParquetWriter(sink, schema, compression="zstd")
+
+	def flush(rows: List[Dict[str, Any]]) -> None:
+		writer.write_table(pa.Table.from_pylist(rows, schema=schema), row_group_size=len(rows))
+
+	rows: List[Dict[str, Any]] = []
+	buffered = 0
+	for doc in records:
+		row = _flat_row(doc, columns)
+		rows.append(row)
+		if chunk_bytes:
+			buffered += _row_bytes(row)
+		if len(rows) >= chunk_rows or (chunk_bytes and buffered >= chunk_bytes):
+			flush(rows)
+			rows.clear()
+			buffered = 0
+			yield sink.drain()
+	if rows:
+		flush(rows)
+	writer.close()
+	yield sink.drain()
+
+
+def require_format(fmt: str) -> None:
+	"""Raise ValueError for unknown formats or when Parquet support is not installed."""
+	if fmt not in EXPORT_FORMATS:
+		raise ValueError(f"Unknown export format: {fmt} (expected one of {', '.join(EXPORT_FORMATS)})")
+	if fmt == "parquet":
+		try:
+			import pyarrow.parquet  # noqa: F401
+		except ImportError:
+			raise ValueError("Parquet export requires pyarrow (pip install pyarrow)")
+
+
+def stream_export(
+	records: Iterable[Dict[str, Any]],
+	fmt: str,
+	include_images: bool = False,
+	chunk_rows: int = EXPORT_BATCH_SIZE,
+	chunk_bytes: int = EXPORT_CHUNK_BYTES,
+) -> Iterator[bytes]:
+	"""Serialize prediction records to CSV, NDJSON or Parquet as a stream of byte chunks.
+
+	A chunk is emitted after chunk_rows records or once about chunk_bytes of
+	output (of string and binary values, for Parquet) is buffered, whichever
+	comes first, so memory stays bounded even with images. CSV and NDJSON
+	chunks are complete lines; Parquet chunks are row groups and only form a
+	valid file once the final chunk (the footer) has been written.
+	"""
+	require_format(fmt)
+	columns = _columns(include_images)
+	chunk_rows = max(1, chunk_rows)
+	chunk_bytes = max(0, chunk_bytes)
+	if fmt == "csv":
+		return _csv_chunks(records, columns, chunk_rows, chunk_bytes)
+	if fmt == "jsonl":
+		return _jsonl_chunks(records, columns, chunk_rows, chunk_bytes)
+	return _parquet_chunks(records, columns, chunk_rows, chunk_bytes)
+
+
+def write_parquet(
+	records: Iterable[Dict[str, Any]],
+	path: Path,
+	chunk_rows: int = EXPORT_BATCH_SIZE,
+	chunk_bytes: int = ARCHIVE_ROW_GROUP_BYTES,
+) -> int:
+	"""Write full records (images and embeddings included) to a Parquet file.
+
+	Records are consumed one row group at a time, so memory is bounded by
+	chunk_rows and chunk_bytes rather than by the number of records. The file
+	is written under a temporary name, fsynced and renamed, so it either exists
+	complete or not at all. Returns the file size in bytes.
+	"""
+	require_format("parquet")
+	partial = path.with_name(path.name + ".partial")
+	with open(partial, "wb") as f:
+		for chunk in _parquet_chunks(records, ARCHIVE_COLUMNS, max(1, chunk_rows), max(0, chunk_bytes)):
+			f.write(chunk)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(partial, path)
+	return path.stat().st_size
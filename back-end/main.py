@@ -1,17 +1,46 @@
 # backend/main.py
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Header, Depends, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from typing import List, Optional
+from datetime import datetime
 from pydantic import BaseModel
-from database import save_prediction, get_history, delete_predictions, check_duplicate, get_analytics, get_unique_fruits
-from model import predict_image, get_class_names
-from PIL import Image
+from contextlib import asynccontextmanager
+from database import save_prediction, get_history, delete_predictions, check_duplicate, get_analytics, get_unique_fruits, find_similar, save_vector_index, iter_predictions
+from model import predict_image_with_embedding, get_class_names, get_model_info, decode_image, get_shadow_evaluator, get_embedding_model
+from perceptual_hash import compute_dhash
+from scheduler import get_scheduler, INTERACTIVE, BULK
+from uploads import read_image_upload, read_model_input_upload, ImageUpload, INPUT_FORMATS, RequestSizeLimitMiddleware
+from profiling import profile_request, stage, list_traces, get_trace, get_config as get_profiling_config
+from export import stream_export, require_format, EXPORT_BATCH_SIZE, MEDIA_TYPES as EXPORT_MEDIA_TYPES
+from retention import run_archive, run_compaction, start_background_archiver, stop_background_archiver, status as retention_status
+from realtime import serve_frame_stream, DEFAULT_SMOOTHING_WINDOW, DEFAULT_KEYFRAME_INTERVAL_S
+import asyncio
+import csv
 import io
+import json
+import os
+import uuid
 from dotenv import load_dotenv
+from PIL import Image
 
 load_dotenv()
 
-app = FastAPI(title="Fruit Classification API")
+_ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_background_archiver()
+    yield
+    stop_background_archiver()
+    try:
+        save_vector_index()
+    except Exception as e:
+        print(f"Error saving vector index: {e}")
+
+
+app = FastAPI(title="Fruit Classification API", lifespan=lifespan)
 
 # Cho phép frontend gọi API
 app.add_middleware(
@@ -20,59 +49,159 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestSizeLimitMiddleware)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Guard admin endpoints with ADMIN_TOKEN when it is configured."""
+    if _ADMIN_TOKEN and x_admin_token != _ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Admin-Token header")
+
+
+def _classify(image: Image.Image, duplicate_info: Optional[dict], update_if_duplicate: bool):
+    """Return (result, embedding), reusing the stored prediction of a duplicate to skip inference."""
+    if duplicate_info and not update_if_duplicate and duplicate_info.get("predicted_label"):
+        return {
+            "label": duplicate_info["predicted_label"],
+            "confidence": duplicate_info["confidence"],
+            "tag": duplicate_info.get("predicted_tag"),
+            "cached": True,
+        }, None
+    return predict_image_with_embedding(image=image)
+
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
-@app.post("/predict")
-async def predict(
-    file: UploadFile = File(...),
-    update_if_duplicate: bool = Query(False, description="Update existing record if duplicate found")
-):
-    """Predict fruit from image. Checks for duplicates before saving.
-    
-    Args:
-        file: Image file to predict
-        update_if_duplicate: If True, update existing record if duplicate found
+def _encode_jpeg(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _process_image(
+    upload: ImageUpload,
+    filename: Optional[str],
+    content_type: Optional[str],
+    update_if_duplicate: bool,
+    original: Optional[ImageUpload] = None,
+) -> dict:
+    """Decode, dedupe, classify and save one uploaded image. Runs on a scheduler worker.
+
+    upload is what the model sees: an image, or a uint8 tensor already at the
+    model's input size. When the client also sends the original image, the
+    record's hash and stored image are those of the original, which is never
+    decoded here.
     """
-    # Nhận file ảnh
-    image_bytes = await file.read()
-    image = Image.open(io.BytesIO(image_bytes))
+    with stage("decode"):
+        if upload.input_format == "image":
+            image = decode_image(upload.open())
+        else:
+            image = Image.fromarray(upload.to_array(), "RGB")
+        image_phash = compute_dhash(image)
 
-    # Gọi model
-    result = predict_image(image_bytes)
+    # The record describes the original image when there is one
+    source = original or upload
+    meta = {"content_type": original.content_type if original else content_type}
+    if upload.input_format != "image" or original:
+        meta["input_format"] = upload.input_format
 
-    # Check for duplicate
-    duplicate_info = check_duplicate(image_bytes)
+    # Check for duplicate (exact or near) before running the model
+    with stage("duplicate_check"):
+        duplicate_info = check_duplicate(image_phash=image_phash, image_hash=source.sha256)
     is_duplicate = duplicate_info is not None
 
+    # Gọi model
+    result, embedding = _classify(image, duplicate_info, update_if_duplicate)
+
     # Lưu vào DB
     prediction_id = None
     is_new_record = True
     try:
-        prediction_id, is_new_record = save_prediction(
-            file.filename,
-            image_bytes,
-            result["label"],
-            float(result["confidence"]),
-            result.get("tag"),
-            extra={"content_type": file.content_type},
-            update_existing=update_if_duplicate and is_duplicate,
-        )
+        with stage("save"):
+            prediction_id, is_new_record = save_prediction(
+                filename,
+                # A bare tensor is stored as a small JPEG so history can display it
+                source.open() if source.input_format == "image" else _encode_jpeg(image),
+                result["label"],
+                float(result["confidence"]),
+                result.get("tag"),
+                extra=meta,
+                update_existing=update_if_duplicate and is_duplicate,
+                image_phash=image_phash,
+                embedding=embedding,
+                embedding_model=get_embedding_model() if embedding is not None else None,
+                near_duplicate=duplicate_info if is_duplicate and duplicate_info["match_type"] == "near" else None,
+                image_hash=source.sha256,
+            )
     except Exception as e:
-        print(f"Error saving prediction: {e}")
+        print(f"Error saving prediction for {filename}: {e}")
         # Không chặn phản hồi nếu DB lỗi
 
-    response = {
-        "filename": file.filename,
+    return {
+        "prediction_id": prediction_id,
         "result": result,
         "is_duplicate": is_duplicate,
         "is_new_record": is_new_record,
+        "duplicate_info": duplicate_info,
+    }
+
+
+async def _read_inputs(file: UploadFile, original: Optional[UploadFile], input_format: str):
+    """Read and cheaply validate the model input and, if sent, the original image."""
+    input_shape = get_model_info()["input_shape"] if input_format != "image" else None
+    upload = await read_model_input_upload(file, input_format, input_shape)
+    return upload, (await read_image_upload(original) if original is not None else None)
+
+
+_INPUT_FORMAT_PATTERN = "^(" + "|".join(INPUT_FORMATS) + ")$"
+
+
+def _client_id(request: Request) -> str:
+    """Identify the caller for per-client scheduling limits."""
+    return request.headers.get("X-Client-Id") or (request.client.host if request.client else "anonymous")
+
+
+@app.post("/predict")
+async def predict(
+    request: Request,
+    file: UploadFile = File(...),
+    original: Optional[UploadFile] = File(None),
+    update_if_duplicate: bool = Query(False, description="Update existing record if duplicate found"),
+    input_format: str = Query("image", pattern=_INPUT_FORMAT_PATTERN, description="Format of file; see /model-info"),
+):
+    """Predict fruit from image. Checks for duplicates before saving.
+    
+    Runs in the scheduler's interactive class, ahead of queued batch work.
+    
+    Args:
+        file: Image file to predict, or the client-resized model input
+        original: Optional full-size image behind a client-resized file; it is
+            hashed and stored but not decoded
+        update_if_duplicate: If True, update existing record if duplicate found
+        input_format: "image", "npy" or "raw" (uint8 RGB at the /model-info input shape), or "auto"
+    """
+    with profile_request("/predict", filename=file.filename, input_format=input_format):
+        # Nhận file ảnh
+        with stage("read"):
+            upload, original_upload = await _read_inputs(file, original, input_format)
+
+        outcome = await get_scheduler().run(
+            INTERACTIVE, _client_id(request), _process_image,
+            upload, (original or file).filename, file.content_type, update_if_duplicate, original_upload,
+        )
+
+    is_duplicate = outcome["is_duplicate"]
+    response = {
+        "filename": (original or file).filename,
+        "result": outcome["result"],
+        "is_duplicate": is_duplicate,
+        "is_new_record": outcome["is_new_record"],
     }
     
     if is_duplicate:
-        response["duplicate_info"] = duplicate_info
+        response["duplicate_info"] = outcome["duplicate_info"]
         if not update_if_duplicate:
             response["message"] = "This image was already uploaded before. A new record was created."
         else:
@@ -84,56 +213,52 @@ async def predict(
 
 @app.post("/batch-predict")
 async def batch_predict(
+    request: Request,
     files: List[UploadFile] = File(...),
-    update_if_duplicate: bool = Query(False, description="Update existing records if duplicates found")
+    originals: Optional[List[UploadFile]] = File(None),
+    update_if_duplicate: bool = Query(False, description="Update existing records if duplicates found"),
+    input_format: str = Query("image", pattern=_INPUT_FORMAT_PATTERN, description="Format of files; see /model-info"),
 ):
     """Process multiple images in batch and save all predictions to MongoDB.
     Checks for duplicates before saving.
+
+    Images are queued in the scheduler's bulk class, so they never delay
+    single-image predictions; items kept waiting by other clients' work for
+    BULK_DEADLINE_S are reported as errors instead of processed.
+
+    With client-resized inputs, originals (if sent) pair with files by position.
     """
-    results = []
-    
-    for file in files:
+    if originals and len(originals) != len(files):
+        raise HTTPException(status_code=400, detail=f"Got {len(originals)} originals for {len(files)} files")
+    client_id = _client_id(request)
+    scheduler = get_scheduler()
+
+    async def process_file(file: UploadFile, original: Optional[UploadFile]) -> dict:
+        filename = (original or file).filename
         try:
             # Đọc file ảnh
-            image_bytes = await file.read()
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # Gọi model để predict
-            result = predict_image(image_bytes)
-            
-            # Check for duplicate
-            duplicate_info = check_duplicate(image_bytes)
-            is_duplicate = duplicate_info is not None
-            
-            # Lưu vào DB
-            is_new_record = True
-            try:
-                _, is_new_record = save_prediction(
-                    file.filename or f"batch_{file.filename}",
-                    image_bytes,
-                    result["label"],
-                    float(result["confidence"]),
-                    result.get("tag"),
-                    extra={"content_type": file.content_type},
-                    update_existing=update_if_duplicate and is_duplicate,
-                )
-            except Exception as e:
-                print(f"Error saving prediction for {file.filename}: {e}")
-                # Tiếp tục xử lý các file khác dù có lỗi
-            
-            results.append({
-                "filename": file.filename,
-                "result": result,
-                "is_duplicate": is_duplicate,
-                "is_new_record": is_new_record,
-                "duplicate_info": duplicate_info if is_duplicate else None,
-            })
+            with stage("read"):
+                upload, original_upload = await _read_inputs(file, original, input_format)
+            outcome = await scheduler.run(
+                BULK, client_id, _process_image,
+                upload, filename or f"batch_{filename}", file.content_type, update_if_duplicate, original_upload,
+            )
+            return {
+                "filename": filename,
+                "result": outcome["result"],
+                "is_duplicate": outcome["is_duplicate"],
+                "is_new_record": outcome["is_new_record"],
+                "duplicate_info": outcome["duplicate_info"],
+            }
         except Exception as e:
-            print(f"Error processing {file.filename}: {e}")
-            results.append({
-                "filename": file.filename,
+            print(f"Error processing {filename}: {e}")
+            return {
+                "filename": filename,
                 "error": str(e)
-            })
+            }
+
+    with profile_request("/batch-predict", files=len(files), input_format=input_format):
+        results = await asyncio.gather(*(process_file(file, originals[i] if originals else None) for i, file in enumerate(files)))
     
     duplicate_count = len([r for r in results if r.get("is_duplicate", False)])
     new_count = len([r for r in results if r.get("is_new_record", False)])
@@ -146,6 +271,33 @@ async def batch_predict(
         "new_records": new_count,
     }
 
+@app.websocket("/ws/predict")
+async def ws_predict(
+    websocket: WebSocket,
+    smoothing: int = Query(DEFAULT_SMOOTHING_WINDOW, ge=1, le=100, description="Frames in the smoothed-label vote"),
+    keyframe_interval: float = Query(DEFAULT_KEYFRAME_INTERVAL_S, ge=0, description="Seconds between saved keyframes; 0 disables saving"),
+):
+    """Classify a continuous stream of camera frames.
+
+    Send each frame as a binary message (JPEG/PNG). Each processed frame gets a
+    JSON reply with the raw and smoothed prediction, latency and drop counters.
+    When frames arrive faster than the model keeps up, only the newest pending
+    frame is classified and the skipped ones are counted as dropped.
+    """
+    client = websocket.headers.get("X-Client-Id") or (websocket.client.host if websocket.client else "anonymous")
+    stream_id = f"{client}-{uuid.uuid4().hex[:8]}"
+    await serve_frame_stream(websocket, stream_id, smoothing, keyframe_interval)
+
+
+@app.get("/model-info")
+def model_info():
+    """Describe the model input so clients can resize on their side and send tensors or small images."""
+    try:
+        return get_model_info()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting model info: {str(e)}")
+
+
 @app.get("/history")
 def history():
     data = get_history()
@@ -170,6 +322,43 @@ async def delete_history(request: DeletePredictionsRequest):
         raise HTTPException(status_code=500, detail=f"Error deleting predictions: {str(e)}")
 
 
+@app.get("/export", dependencies=[Depends(require_admin)])
+def export_history(
+    format: str = Query("csv", pattern="^(csv|jsonl|parquet)$"),
+    start: Optional[datetime] = Query(None, description="Only records created at or after this time (ISO 8601)"),
+    end: Optional[datetime] = Query(None, description="Only records created before this time (ISO 8601)"),
+    label: Optional[List[str]] = Query(None, description="Only these predicted labels; repeat for several"),
+    include_images: bool = Query(False, description="Include image_base64 (large)"),
+):
+    """Stream the whole predictions collection as CSV, NDJSON or Parquet.
+
+    Records are read from a cursor in EXPORT_BATCH_SIZE batches and written out
+    chunk by chunk, so memory stays flat regardless of collection size.
+    """
+    try:
+        require_format(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    records = iter_predictions(start, end, label, include_images, batch_size=EXPORT_BATCH_SIZE)
+    return StreamingResponse(
+        stream_export(records, format, include_images),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=predictions.{format}"},
+    )
+
+
+@app.get("/similar/{prediction_id}")
+def similar(prediction_id: str, limit: int = Query(10, ge=1, le=100)):
+    """Get the stored images most similar to a prediction, by model embedding."""
+    try:
+        matches = find_similar(prediction_id, limit, get_embedding_model())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching similar images: {str(e)}")
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Prediction not found or has no embedding")
+    return {"id": prediction_id, "similar": matches}
+
+
 @app.get("/analytics")
 def analytics():
     """Get analytics data for dashboard."""
@@ -200,3 +389,79 @@ def get_labels():
         return {"labels": labels}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting labels: {str(e)}")
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+def profiles(limit: int = Query(50, ge=1, le=500)):
+    """List captured request traces (sampled and slow requests), newest first."""
+    return {"config": get_profiling_config(), "traces": list_traces(limit)}
+
+
+@app.get("/admin/profiles/{trace_id}", dependencies=[Depends(require_admin)])
+def profile_detail(trace_id: str):
+    """Get the stage breakdown and cProfile report of a captured trace."""
+    trace = get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
+
+
+@app.get("/admin/scheduler", dependencies=[Depends(require_admin)])
+def scheduler_stats():
+    """Get queue depths, running work, shed counts and queue waits per priority class."""
+    return get_scheduler().stats()
+
+
+@app.get("/admin/shadow", dependencies=[Depends(require_admin)])
+def shadow_summary():
+    """Get shadow-evaluation results: latency percentiles, top-1 agreement, confidence deltas."""
+    evaluator = get_shadow_evaluator()
+    if evaluator is None:
+        return {"enabled": False}
+    return {"enabled": True, **evaluator.summary()}
+
+
+@app.get("/admin/shadow/export", dependencies=[Depends(require_admin)])
+def shadow_export(format: str = Query("csv", pattern="^(csv|jsonl)$")):
+    """Export per-request shadow comparisons for offline analysis."""
+    evaluator = get_shadow_evaluator()
+    if evaluator is None:
+        raise HTTPException(status_code=404, detail="Shadow mode is not enabled (set SHADOW_MODEL)")
+    records = evaluator.records()
+    if format == "jsonl":
+        body = "".join(json.dumps(r) + "\n" for r in records)
+        return Response(body, media_type="application/x-ndjson",
+                        headers={"Content-Disposition": "attachment; filename=shadow.jsonl"})
+    buffer = io.StringIO()
+    if records:
+        writer = csv.DictWriter(buffer, fieldnames=list(records[0].keys()))
+        writer.writeheader()
+        writer.writerows(records)
+    return Response(buffer.getvalue(), media_type="text/csv",
+                    headers={"Content-Disposition": "attachment; filename=shadow.csv"})
+
+
+@app.get("/admin/retention", dependencies=[Depends(require_admin)])
+def retention():
+    """Get the retention policies, background archiver state and the last run reports."""
+    return retention_status()
+
+
+@app.post("/admin/retention/archive", dependencies=[Depends(require_admin)])
+def retention_archive():
+    """Archive every record past its retention policy to Parquet and remove it from MongoDB."""
+    try:
+        return run_archive()
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/admin/retention/compact", dependencies=[Depends(require_admin)])
+def retention_compact(release_space: bool = Query(False, description="Also run MongoDB compact to return freed space to the filesystem")):
+    """Re-point or unlink orphaned duplicates, drop redundant image copies and report reclaimed storage."""
+    try:
+        return run_compaction(release_space)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
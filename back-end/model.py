@@ -1,7 +1,10 @@
 from __future__ import annotations
 
-from typing import Dict, Optional
+from typing import BinaryIO, Dict, List, Optional, Tuple
 import io
+import os
+import threading
+import time
 import numpy as np
 from pathlib import Path
 
@@ -11,10 +14,34 @@ from tensorflow import keras
 from tensorflow.keras.applications.efficientnet import preprocess_input as efficientnet_preprocess
 from tensorflow.keras.applications.mobilenet_v2 import preprocess_input as mobilenet_preprocess
 
+from profiling import stage
+from shadow import ShadowEvaluator
+from uploads import INPUT_FORMATS
+
 # Global variable to store the loaded model
 _model: Optional[keras.Model] = None
 _class_names: Optional[list] = None
 _model_type: Optional[str] = None  # 'efficientnet', 'mobilenet', or 'generic'
+_primary: Optional["LoadedModel"] = None
+
+# Explicit model file (name inside model/ or a path); otherwise the first .h5 found
+_MODEL_FILE = os.getenv("MODEL_FILE")
+
+# Cascade mode: a fast model answers first, the primary model only when it is unsure
+_CASCADE_FAST_MODEL = os.getenv("CASCADE_FAST_MODEL")
+_CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD", "0.85"))
+_fast: Optional["LoadedModel"] = None
+
+# Shadow mode: evaluate a candidate model (.h5 or .tflite) on sampled live inputs
+_SHADOW_MODEL = os.getenv("SHADOW_MODEL")
+_SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.1"))
+_SHADOW_MAX_PER_SECOND = float(os.getenv("SHADOW_MAX_PER_SECOND", "2"))
+_shadow: Optional[ShadowEvaluator] = None
+
+# Number of primary predictions running right now; shadow work waits for zero
+_inflight = 0
+_inflight_lock = threading.Lock()
+
 _VEGETABLE_LABELS = {
 	"beetroot",
 	"bell pepper",
@@ -56,16 +83,34 @@ def _determine_tag(label: str) -> str:
 	return "fruit"
 
 
+def _model_dir() -> Path:
+	current_dir = Path(__file__).parent
+	return current_dir.parent / "model"
+
+
+def _resolve_model_path(name: str) -> Path:
+	"""Resolve a model given as a path or as a file name inside the model directory."""
+	path = Path(name)
+	if not path.is_absolute() and not path.exists():
+		path = _model_dir() / name
+	if not path.exists():
+		raise FileNotFoundError(f"Model file not found: {name}")
+	return path
+
+
 def _find_model_file() -> Path:
 	"""Find the model .h5 file in the model directory."""
-	current_dir = Path(__file__).parent
-	model_dir = current_dir.parent / "model"
+	if _MODEL_FILE:
+		return _resolve_model_path(_MODEL_FILE)
+	
+	model_dir = _model_dir()
 	
 	if not model_dir.exists():
 		raise FileNotFoundError(f"Model directory not found at {model_dir}")
 	
-	# Tìm file .h5 đầu tiên trong folder model
-	h5_files = list(model_dir.glob("*.h5"))
+	# Tìm file .h5 đầu tiên trong folder model (bỏ qua model cascade/shadow)
+	excluded = {Path(name).name for name in (_CASCADE_FAST_MODEL, _SHADOW_MODEL) if name}
+	h5_files = [p for p in model_dir.glob("*.h5") if p.name not in excluded]
 	if not h5_files:
 		raise FileNotFoundError(
 			f"No .h5 model file found in {model_dir}. "
@@ -99,75 +144,256 @@ def _detect_model_type(model_path: Path, model: keras.Model) -> str:
 	return "generic"
 
 
-def _load_model():
-	"""Load the Keras model from h5 file. This is called once when module is imported."""
-	global _model, _class_names, _model_type
+def _build_feature_model(model: keras.Model) -> Optional[keras.Model]:
+	"""Wrap the model so one forward pass returns the penultimate features and the predictions.
+
+	Uses the last layer before the classifier with a flat (batch, features) output,
+	e.g. the global pooling or dropout layer on top of the backbone.
+	"""
+	try:
+		for layer in reversed(model.layers[:-1]):
+			shape = layer.output.shape
+			if len(shape) == 2 and shape[-1]:
+				return keras.Model(inputs=model.inputs, outputs=[layer.output, model.output])
+	except Exception as e:
+		print(f"Warning: Could not build feature extractor: {e}")
+	return None
+
+
+def _load_class_names(model_path: Path, model: Optional[keras.Model], num_classes: Optional[int]) -> Optional[list]:
+	"""Read class names from model metadata or a .labels.txt/.labels file next to it."""
+	# Try to get class names from model if available
+	# Some models store class names in metadata
+	if hasattr(model, 'class_names'):
+		return model.class_names
+	if hasattr(model, 'config') and 'class_names' in model.config:
+		return model.config['class_names']
 	
-	if _model is not None:
-		return  # Model already loaded
+	# Try to load from labels file next to the model
+	labels_path_txt = model_path.with_suffix(".labels.txt")
+	labels_path = model_path.with_suffix(".labels")
+	labels_file = labels_path_txt if labels_path_txt.exists() else labels_path if labels_path.exists() else None
+	if labels_file:
+		print(f"Loading labels from {labels_file}...")
+		with open(labels_file, "r", encoding="utf-8") as f:
+			class_names = [line.strip() for line in f if line.strip()]
+		print(f"Loaded {len(class_names)} labels from file")
+		if len(class_names) > 0:
+			print(f"   First few labels: {class_names[:5]}")
+		return class_names
 	
-	# Find model file
-	model_path = _find_model_file()
+	print(f" No labels file found. Looking for: {labels_path_txt} or {labels_path}")
+	# If class names not found, we'll use indices
+	if num_classes:
+		print(f"   Using default class names: Class_0 to Class_{num_classes-1}")
+		return [f"Class_{i}" for i in range(num_classes)]
+	return None
+
+
+class LoadedModel:
+	"""A loaded Keras classifier with its labels, preprocessing family and feature extractor."""
+	
+	def __init__(self, path: Path, model: keras.Model, model_type: str, class_names: Optional[list]):
+		self.path = path
+		self.model = model
+		self.model_type = model_type
+		self.class_names = class_names
+		self.feature_model = _build_feature_model(model)
+	
+	@property
+	def target_size(self) -> tuple:
+		# Model input shape is usually (None, height, width, channels)
+		if self.model.input_shape and len(self.model.input_shape) >= 3:
+			return (self.model.input_shape[2], self.model.input_shape[1])  # (width, height)
+		return (224, 224)  # Default size
+	
+	def predict(self, image: Image.Image, stage_name: str = "inference") -> Tuple[Dict[str, float | str], Optional[np.ndarray]]:
+		"""Classify a decoded image; return (result, penultimate-layer embedding or None)."""
+		return self.predict_batch([image], stage_name)[0]
+	
+	def predict_batch(self, images: List[Image.Image], stage_name: str = "inference") -> List[Tuple[Dict[str, float | str], Optional[np.ndarray]]]:
+		"""Classify several decoded images in one forward pass."""
+		# Preprocess image
+		with stage("preprocess"):
+			preprocessed_images = np.concatenate(
+				[_preprocess_image(image, self.target_size, self.model_type) for image in images]
+			)
+		
+		# Make prediction
+		with stage(stage_name):
+			predictions, embeddings = self._forward(preprocessed_images)
+		
+		outputs = []
+		for i, row in enumerate(predictions):
+			# If model outputs logits (no softmax), convert to probabilities
+			row_sum = float(np.sum(row))
+			# Heuristic: if sum is not approximately 1, apply softmax
+			if not (0.99 <= row_sum <= 1.01):
+				row = tf.nn.softmax(row).numpy()
+			
+			# Get the predicted class index and confidence
+			predicted_index = np.argmax(row)
+			confidence = float(row[predicted_index])
+			
+			# Get class name
+			if self.class_names and predicted_index < len(self.class_names):
+				label = self.class_names[predicted_index]
+			else:
+				label = f"Class_{predicted_index}"
+			
+			outputs.append(({
+				"label": label,
+				"confidence": round(confidence, 4),
+				"tag": _determine_tag(label),
+			}, embeddings[i] if embeddings is not None else None))
+		return outputs
+	
+	def _forward(self, preprocessed_images: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+		"""Return (probabilities or logits, embeddings or None) for a preprocessed batch."""
+		if self.feature_model is not None:
+			features, predictions = self.feature_model.predict(preprocessed_images, verbose=0)
+			return predictions, features.astype(np.float32)
+		return self.model.predict(preprocessed_images, verbose=0), None
+
+
+class TFLiteModel(LoadedModel):
+	"""A TensorFlow Lite (e.g. post-training quantized) classifier behind the LoadedModel interface."""
+	
+	def __init__(self, path: Path, interpreter: tf.lite.Interpreter, model_type: str, class_names: Optional[list]):
+		self.path = path
+		self.model = interpreter
+		self.model_type = model_type
+		self.class_names = class_names
+		self.feature_model = None
+		self._input = interpreter.get_input_details()[0]
+		self._output = interpreter.get_output_details()[0]
+		# An interpreter must not be invoked from two threads at once
+		self._lock = threading.Lock()
 	
+	@property
+	def target_size(self) -> tuple:
+		shape = self._input["shape"]
+		return (int(shape[2]), int(shape[1]))  # (width, height)
+	
+	def _forward(self, preprocessed_images: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+		data = preprocessed_images
+		input_dtype = self._input["dtype"]
+		if input_dtype in (np.uint8, np.int8):
+			# Quantize the float input with the model's own scale/zero point
+			scale, zero_point = self._input["quantization"]
+			limits = np.iinfo(input_dtype)
+			data = np.clip(np.round(data / scale + zero_point), limits.min, limits.max)
+		data = data.astype(input_dtype)
+		rows = []
+		with self._lock:
+			# The interpreter was allocated for a batch of one
+			for sample in data:
+				self.model.set_tensor(self._input["index"], sample[None, ...])
+				self.model.invoke()
+				rows.append(self.model.get_tensor(self._output["index"])[0])
+		predictions = np.stack(rows)
+		if self._output["dtype"] in (np.uint8, np.int8):
+			scale, zero_point = self._output["quantization"]
+			predictions = (predictions.astype(np.float32) - zero_point) * scale
+		return predictions.astype(np.float32), None
+
+
+def _load_tflite_model(model_path: Path) -> TFLiteModel:
+	interpreter = tf.lite.Interpreter(model_path=str(model_path))
+	interpreter.allocate_tensors()
+	model_type = _detect_model_type(model_path, interpreter)
+	num_classes = int(interpreter.get_output_details()[0]["shape"][-1])
+	print(f"TFLite model loaded successfully!")
+	print(f"Model type detected: {model_type}")
+	print(f"Model input: {interpreter.get_input_details()[0]['shape']} {interpreter.get_input_details()[0]['dtype'].__name__}")
+	return TFLiteModel(model_path, interpreter, model_type, _load_class_names(model_path, None, num_classes))
+
+
+def load_model_from_path(model_path: Path) -> LoadedModel:
+	"""Load a Keras .h5 (or TFLite .tflite) model with its labels and detected preprocessing family."""
 	print(f"Loading model from {model_path}...")
 	try:
+		if model_path.suffix == ".tflite":
+			return _load_tflite_model(model_path)
+		
 		# Load the model
-		_model = keras.models.load_model(str(model_path))
+		model = keras.models.load_model(str(model_path))
 		
 		# Detect model type
-		_model_type = _detect_model_type(model_path, _model)
+		model_type = _detect_model_type(model_path, model)
 		
 		print(f"Model loaded successfully!")
-		print(f"Model type detected: {_model_type}")
-		print(f"Model input shape: {_model.input_shape}")
-		print(f"Model output shape: {_model.output_shape}")
-		
-		# Try to get class names from model if available
-		# Some models store class names in metadata
-		if hasattr(_model, 'class_names'):
-			_class_names = _model.class_names
-		elif hasattr(_model, 'config') and 'class_names' in _model.config:
-			_class_names = _model.config['class_names']
-		else:
-			# Try to load from labels file next to the model
-			labels_path_txt = model_path.with_suffix(".labels.txt")
-			labels_path = model_path.with_suffix(".labels")
-			labels_file = labels_path_txt if labels_path_txt.exists() else labels_path if labels_path.exists() else None
-			if labels_file:
-				print(f"Loading labels from {labels_file}...")
-				with open(labels_file, "r", encoding="utf-8") as f:
-					_class_names = [line.strip() for line in f if line.strip()]
-				print(f"Loaded {len(_class_names)} labels from file")
-				if len(_class_names) > 0:
-					print(f"   First few labels: {_class_names[:5]}")
-			else:
-				print(f" No labels file found. Looking for: {labels_path_txt} or {labels_path}")
-				# If class names not found, we'll use indices
-				num_classes = _model.output_shape[-1] if _model.output_shape else None
-				if num_classes:
-					_class_names = [f"Class_{i}" for i in range(num_classes)]
-					print(f"   Using default class names: Class_0 to Class_{num_classes-1}")
-				else:
-					_class_names = None
+		print(f"Model type detected: {model_type}")
+		print(f"Model input shape: {model.input_shape}")
+		print(f"Model output shape: {model.output_shape}")
 		
-		print(f"Number of classes: {len(_class_names) if _class_names else 'Unknown'}")
+		num_classes = model.output_shape[-1] if model.output_shape else None
+		loaded = LoadedModel(model_path, model, model_type, _load_class_names(model_path, model, num_classes))
+		if loaded.feature_model is not None:
+			print(f"Embedding size: {loaded.feature_model.output_shape[0][-1]}")
+		print(f"Number of classes: {len(loaded.class_names) if loaded.class_names else 'Unknown'}")
+		return loaded
 		
 	except Exception as e:
 		raise RuntimeError(f"Failed to load model: {str(e)}")
 
 
-def _preprocess_image(image_bytes: bytes, target_size: tuple = (224, 224)) -> np.ndarray:
-	"""Preprocess image for model inference.
+def _load_model():
+	"""Load the Keras model from h5 file. This is called once when module is imported."""
+	global _model, _class_names, _model_type, _primary
 	
-	Args:
-		image_bytes: Raw image bytes
-		target_size: Target size (width, height) for resizing
-		
-	Returns:
-		Preprocessed image array ready for model input
-	"""
+	if _model is not None:
+		return  # Model already loaded
+	
+	# Find model file
+	model_path = _find_model_file()
+	
+	_primary = load_model_from_path(model_path)
+	_model, _class_names, _model_type = _primary.model, _primary.class_names, _primary.model_type
+	
+	_load_cascade_model(model_path)
+	_load_shadow_model()
+
+
+def _load_cascade_model(model_path: Path):
+	global _fast
+	
+	if not _CASCADE_FAST_MODEL:
+		return
+	try:
+		fast = load_model_from_path(_resolve_model_path(_CASCADE_FAST_MODEL))
+	except Exception as e:
+		print(f"Warning: Could not load cascade fast model, cascade disabled: {e}")
+		return
+	if set(fast.class_names or []) != set(_class_names or []):
+		print("Warning: Cascade fast model has different labels than the primary model, cascade disabled.")
+		return
+	_fast = fast
+	print(f"Cascade enabled: {fast.path.name} answers when confidence >= {_CASCADE_THRESHOLD}, else {model_path.name}")
+
+
+def _is_busy() -> bool:
+	return _inflight > 0
+
+
+def _load_shadow_model():
+	global _shadow
+	
+	if not _SHADOW_MODEL:
+		return
+	try:
+		candidate = load_model_from_path(_resolve_model_path(_SHADOW_MODEL))
+	except Exception as e:
+		print(f"Warning: Could not load shadow model, shadow mode disabled: {e}")
+		return
+	_shadow = ShadowEvaluator(candidate, _SHADOW_SAMPLE_RATE, _SHADOW_MAX_PER_SECOND, _is_busy)
+	print(f"Shadow mode enabled: {candidate.path.name} on {_SHADOW_SAMPLE_RATE:.0%} of requests, at most {_SHADOW_MAX_PER_SECOND}/s")
+
+
+def decode_image(image_bytes: bytes | BinaryIO) -> Image.Image:
+	"""Decode raw bytes (or a binary file object) into an upright RGB PIL image."""
 	# Open and convert image
-	image = Image.open(io.BytesIO(image_bytes))
+	image = Image.open(io.BytesIO(image_bytes) if isinstance(image_bytes, bytes) else image_bytes)
 	
 	# Honor EXIF orientation (prevents sideways/upside-down inputs)
 	image = ImageOps.exif_transpose(image)
@@ -176,18 +402,38 @@ def _preprocess_image(image_bytes: bytes, target_size: tuple = (224, 224)) -> np
 	if image.mode != 'RGB':
 		image = image.convert('RGB')
 	
-	# Resize image to target size
-	image = image.resize(target_size, Image.Resampling.LANCZOS)
+	return image
+
+
+def _preprocess_image(
+	image: Image.Image,
+	target_size: tuple = (224, 224),
+	model_type: Optional[str] = None,
+) -> np.ndarray:
+	"""Preprocess image for model inference.
+	
+	Args:
+		image: Decoded RGB image (from decode_image)
+		target_size: Target size (width, height) for resizing
+		model_type: Preprocessing family; defaults to the primary model's
+		
+	Returns:
+		Preprocessed image array ready for model input
+	"""
+	# Resize image to target size (client-resized inputs already match it)
+	if image.size != tuple(target_size):
+		image = image.resize(target_size, Image.Resampling.LANCZOS)
 	
 	# Convert to numpy array
 	img_array = np.array(image, dtype=np.float32)
 	
 	# Apply model-specific preprocessing
-	global _model_type
-	if _model_type == "efficientnet":
+	if model_type is None:
+		model_type = _model_type
+	if model_type == "efficientnet":
 		# EfficientNet preprocessing (scales to [-1, 1] with normalization)
 		img_array = efficientnet_preprocess(img_array)
-	elif _model_type == "mobilenet":
+	elif model_type == "mobilenet":
 		# MobileNetV2 preprocessing (scales to [-1, 1] with normalization)
 		img_array = mobilenet_preprocess(img_array)
 	else:
@@ -200,65 +446,88 @@ def _preprocess_image(image_bytes: bytes, target_size: tuple = (224, 224)) -> np
 	return img_array
 
 
-def predict_image(image_bytes: bytes) -> Dict[str, float | str]:
+def predict_image(image_bytes: bytes | BinaryIO | None = None, image: Optional[Image.Image] = None) -> Dict[str, float | str]:
 	"""Predict fruit class from image using the loaded Keras model.
 	
 	Args:
-		image_bytes: Raw image bytes
+		image_bytes: Raw image bytes or a binary file object (unused if image is given)
+		image: Already decoded image (from decode_image), to avoid decoding twice
 		
 	Returns:
 		Dict with 'label' (str) and 'confidence' (float) keys
 	"""
-	global _model, _class_names
+	result, _ = predict_image_with_embedding(image_bytes, image)
+	return result
+
+
+def predict_image_with_embedding(
+	image_bytes: bytes | BinaryIO | None = None,
+	image: Optional[Image.Image] = None,
+) -> Tuple[Dict[str, float | str], Optional[np.ndarray]]:
+	"""Like predict_image, but also return the penultimate-layer features.
+	
+	Both come from the same forward pass. The embedding is a float32 vector, or
+	None if the model has no usable penultimate layer.
+	
+	In cascade mode (CASCADE_FAST_MODEL set) the fast model answers whenever its
+	top-1 confidence reaches CASCADE_THRESHOLD and the primary model runs only for
+	the rest; the result's "stage" is "fast" or "full". The embedding then always
+	comes from the fast model, which sees every image; get_embedding_model names
+	the model it came from, which is stored with it so toggling the cascade never
+	mixes feature spaces in the similarity index.
+	"""
+	try:
+		if image is None:
+			image = decode_image(image_bytes)
+		return predict_images([image])[0]
+	except Exception as e:
+		raise RuntimeError(f"Error during prediction: {str(e)}")
+
+
+def predict_images(images: List[Image.Image]) -> List[Tuple[Dict[str, float | str], Optional[np.ndarray]]]:
+	"""Batched predict_image_with_embedding for decoded images: one forward pass per model."""
+	global _primary, _inflight
 	
 	# Load model if not already loaded
-	if _model is None:
+	if _primary is None:
 		_load_model()
 	
-	if _model is None:
+	if _primary is None:
 		raise RuntimeError("Model failed to load. Cannot make predictions.")
 	
+	with _inflight_lock:
+		_inflight += 1
+	started = time.perf_counter()
 	try:
-		# Get target size from model input shape
-		# Model input shape is usually (None, height, width, channels)
-		if _model.input_shape and len(_model.input_shape) >= 3:
-			target_size = (_model.input_shape[2], _model.input_shape[1])  # (width, height)
-		else:
-			target_size = (224, 224)  # Default size
-		
-		# Preprocess image
-		preprocessed_image = _preprocess_image(image_bytes, target_size)
-		
-		# Make prediction
-		predictions = _model.predict(preprocessed_image, verbose=0)
-		
-		# If model outputs logits (no softmax), convert to probabilities
-		if predictions.ndim == 2 and predictions.shape[0] == 1:
-			row = predictions[0]
-			row_sum = float(np.sum(row))
-			# Heuristic: if sum is not approximately 1, apply softmax
-			if not (0.99 <= row_sum <= 1.01):
-				row = tf.nn.softmax(row).numpy()
-				predictions = np.expand_dims(row, axis=0)
-		
-		# Get the predicted class index and confidence
-		predicted_index = np.argmax(predictions[0])
-		confidence = float(predictions[0][predicted_index])
-		
-		# Get class name
-		if _class_names and predicted_index < len(_class_names):
-			label = _class_names[predicted_index]
-		else:
-			label = f"Class_{predicted_index}"
-		
-		return {
-			"label": label,
-			"confidence": round(confidence, 4),
-			"tag": _determine_tag(label),
-		}
-		
-	except Exception as e:
-		raise RuntimeError(f"Error during prediction: {str(e)}")
+		outputs = _predict_primary(images)
+	finally:
+		with _inflight_lock:
+			_inflight -= 1
+	
+	if _shadow is not None:
+		per_image_ms = (time.perf_counter() - started) * 1000 / len(images)
+		for image, (result, _) in zip(images, outputs):
+			_shadow.submit(image, result, per_image_ms)
+	return outputs
+
+
+def _predict_primary(images: List[Image.Image]) -> List[Tuple[Dict[str, float | str], Optional[np.ndarray]]]:
+	"""Serve decoded images, through the cascade if one is configured."""
+	if _fast is None:
+		return _primary.predict_batch(images)
+	
+	outputs = _fast.predict_batch(images, stage_name="inference_fast")
+	uncertain = [i for i, (result, _) in enumerate(outputs) if result["confidence"] < _CASCADE_THRESHOLD]
+	for result, _ in outputs:
+		result["stage"] = "fast"
+	if uncertain:
+		full_outputs = _primary.predict_batch([images[i] for i in uncertain])
+		for i, (result, _) in zip(uncertain, full_outputs):
+			result["stage"] = "full"
+			result["fast_confidence"] = outputs[i][0]["confidence"]
+			# Keep the fast model's embedding so every image lives in one feature space
+			outputs[i] = (result, outputs[i][1])
+	return outputs
 
 
 def get_class_names() -> Optional[list]:
@@ -276,9 +545,68 @@ def get_class_names() -> Optional[list]:
 	return _class_names
 
 
-# Load model when module is imported
-try:
-	_load_model()
-except Exception as e:
-	print(f"Warning: Could not load model at startup: {e}")
-	print("Model will be loaded on first prediction call.")
+_PREPROCESSING = {
+	"efficientnet": "EfficientNet preprocess_input, applied by the server",
+	"mobilenet": "MobileNetV2 preprocess_input (scale to [-1, 1]), applied by the server",
+	"generic": "divide by 255, applied by the server",
+}
+
+
+def get_model_info() -> Dict[str, object]:
+	"""Describe the input the primary model expects, so clients can resize on their side.
+
+	Clients send uint8 RGB pixels at input_shape; the preprocessing family's
+	normalization is always applied on the server.
+	"""
+	if _primary is None:
+		_load_model()
+	if _primary is None:
+		raise RuntimeError("Model failed to load.")
+
+	width, height = _primary.target_size
+	info: Dict[str, object] = {
+		"model": _primary.path.name,
+		"input_shape": [int(height), int(width), 3],
+		"layout": "HWC",
+		"dtype": "uint8",
+		"color_order": "RGB",
+		"resize": "lanczos",
+		"preprocessing": _primary.model_type,
+		"normalization": _PREPROCESSING.get(_primary.model_type, _PREPROCESSING["generic"]),
+		"num_classes": len(_primary.class_names) if _primary.class_names else None,
+		"input_formats": list(INPUT_FORMATS),
+	}
+	if _fast is not None and _fast.target_size != _primary.target_size:
+		# Inputs at the primary's size are resized again for the fast model
+		fast_width, fast_height = _fast.target_size
+		info["cascade_fast_input_shape"] = [int(fast_height), int(fast_width), 3]
+	return info
+
+
+def get_embedding_model() -> Optional[str]:
+	"""Name of the model whose features are returned as embeddings (the fast model in cascade mode)."""
+	if _primary is None:
+		try:
+			_load_model()
+		except Exception:
+			return None
+	source = _fast if _fast is not None else _primary
+	if source is None or source.feature_model is None:
+		return None
+	return source.path.name
+
+
+def get_shadow_evaluator() -> Optional[ShadowEvaluator]:
+	"""Get the shadow evaluator, or None if SHADOW_MODEL is not configured."""
+	if _model is None:
+		_load_model()
+	return _shadow
+
+
+# Load model when module is imported, unless the importer only needs the helpers
+if os.getenv("MODEL_EAGER_LOAD", "true").lower() not in ("0", "false", "no"):
+	try:
+		_load_model()
+	except Exception as e:
+		print(f"Warning: Could not load model at startup: {e}")
+		print("Model will be loaded on first prediction call.")
@@ -0,0 +1,98 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+HASH_BITS = 64
+
+
+def compute_dhash(image: Image.Image, hash_size: int = 8) -> str:
+	"""Compute a 64-bit difference hash (dHash) of an image as a 16-char hex string.
+
+	The hash only depends on coarse luminance gradients, so it survives re-encoding,
+	resizing and EXIF stripping, unlike the SHA-256 of the raw bytes.
+	"""
+	gray = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+	pixels = list(gray.getdata())
+	value = 0
+	for row in range(hash_size):
+		offset = row * (hash_size + 1)
+		for col in range(hash_size):
+			value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+	return f"{value:0{HASH_BITS // 4}x}"
+
+
+def hamming_distance(a: int, b: int) -> int:
+	return (a ^ b).bit_count()
+
+
+class MultiIndexHash:
+	"""Hamming-distance index over 64-bit hashes using multi-index hashing.
+
+	The hash is split into max_distance + 1 disjoint chunks. By the pigeonhole
+	principle any hash within max_distance of the query matches it exactly on at
+	least one chunk, so a lookup only verifies the few candidates sharing a chunk
+	bucket instead of scanning every record.
+	"""
+
+	def __init__(self, max_distance: int):
+		self.max_distance = max_distance
+		num_chunks = max_distance + 1
+		base, extra = divmod(HASH_BITS, num_chunks)
+		self._chunks: List[Tuple[int, int]] = []  # (shift, mask)
+		shift = HASH_BITS
+		for i in range(num_chunks):
+			width = base + (1 if i < extra else 0)
+			shift -= width
+			self._chunks.append((shift, (1 << width) - 1))
+		self._tables: List[Dict[int, List[str]]] = [{} for _ in self._chunks]
+		self._hashes: Dict[str, int] = {}
+		self._lock = threading.Lock()
+
+	def __len__(self) -> int:
+		return len(self._hashes)
+
+	def add(self, record_id: str, hex_hash: str) -> None:
+		value = int(hex_hash, 16)
+		with self._lock:
+			if record_id in self._hashes:
+				return
+			self._hashes[record_id] = value
+			for table, (shift, mask) in zip(self._tables, self._chunks):
+				table.setdefault((value >> shift) & mask, []).append(record_id)
+
+	def remove(self, record_id: str) -> None:
+		with self._lock:
+			value = self._hashes.pop(record_id, None)
+			if value is None:
+				return
+			for table, (shift, mask) in zip(self._tables, self._chunks):
+				key = (value >> shift) & mask
+				bucket = table.get(key)
+				if bucket is None:
+					continue
+				try:
+					bucket.remove(record_id)
+				except ValueError:
+					pass
+				if not bucket:
+					del table[key]
+
+	def nearest(self, hex_hash: str, max_distance: Optional[int] = None) -> Optional[Tuple[str, int]]:
+		"""Return (record_id, distance) of the closest hash within max_distance, or None."""
+		radius = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+		value = int(hex_hash, 16)
+		best: Optional[Tuple[str, int]] = None
+		seen = set()
+		with self._lock:
+			for table, (shift, mask) in zip(self._tables, self._chunks):
+				for record_id in table.get((value >> shift) & mask, ()):
+					if record_id in seen:
+						continue
+					seen.add(record_id)
+					distance = hamming_distance(value, self._hashes[record_id])
+					if distance <= radius and (best is None or distance < best[1]):
+						best = (record_id, distance)
+						if distance == 0:
+							return best
+		return best
@@ -0,0 +1,264 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+# Opt-in: with the defaults below nothing is sampled or captured
+_PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(Path(__file__).parent / "profiles")))
+_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # fraction of requests, 0..1
+_TF_PROFILER = os.getenv("PROFILE_TF", "false").lower() in ("1", "true", "yes")
+_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))  # 0 disables slow-request capture
+_MAX_TRACES = int(os.getenv("PROFILE_MAX_TRACES", "100"))
+_TOP_FUNCTIONS = 40
+
+_TRACE_ID_RE = re.compile(r"^[0-9]+-[0-9a-f]{8}$")
+
+_current_trace: ContextVar[Optional["_RequestTrace"]] = ContextVar("current_trace", default=None)
+
+# cProfile and the TF profiler can only have one active session per process
+_profiler_lock = threading.Lock()
+_ring_lock = threading.Lock()
+
+
+class _RequestTrace:
+	"""Per-request stage timings, plus profiler state when the request was sampled."""
+
+	def __init__(self, endpoint: str, meta: Dict[str, Any]):
+		self.trace_id = f"{time.time_ns() // 1_000_000}-{uuid.uuid4().hex[:8]}"
+		self.endpoint = endpoint
+		self.meta = dict(meta)
+		self.started_at = datetime.now(timezone.utc)
+		self.started = time.perf_counter()
+		self.stages: List[Dict[str, Any]] = []
+		self.profiler: Optional[cProfile.Profile] = None
+		# Profiles of work this request handed to other threads (see run_profiled)
+		self.thread_profilers: List[cProfile.Profile] = []
+		self.tf_logdir: Optional[Path] = None
+
+	def add_stage(self, name: str, elapsed_ms: float) -> None:
+		self.stages.append({"name": name, "ms": round(elapsed_ms, 3)})
+
+	def stage_totals(self) -> Dict[str, float]:
+		totals: Dict[str, float] = {}
+		for item in self.stages:
+			totals[item["name"]] = round(totals.get(item["name"], 0.0) + item["ms"], 3)
+		return totals
+
+
+def is_enabled() -> bool:
+	"""Return True if sampling or slow-request capture is configured."""
+	return _SAMPLE_RATE > 0 or _SLOW_REQUEST_MS > 0
+
+
+def _start_profilers(trace: _RequestTrace) -> None:
+	"""Attach cProfile (and optionally the TF profiler) if no other session is running."""
+	if not _profiler_lock.acquire(blocking=False):
+		return
+	try:
+		trace.profiler = cProfile.Profile()
+		trace.profiler.enable()
+	except Exception as e:
+		print(f"[PROFILE] Could not start cProfile: {e}")
+		trace.profiler = None
+		_profiler_lock.release()
+		return
+
+	if _TF_PROFILER:
+		try:
+			import tensorflow as tf
+			logdir = _PROFILE_DIR / trace.trace_id / "tf"
+			logdir.mkdir(parents=True, exist_ok=True)
+			tf.profiler.experimental.start(str(logdir))
+			trace.tf_logdir = logdir
+		except Exception as e:
+			print(f"[PROFILE] Could not start TensorFlow profiler: {e}")
+
+
+def _stop_profilers(trace: _RequestTrace) -> None:
+	if trace.profiler is None:
+		return
+	try:
+		trace.profiler.disable()
+		if trace.tf_logdir is not None:
+			try:
+				import tensorflow as tf
+				tf.profiler.experimental.stop()
+			except Exception as e:
+				print(f"[PROFILE] Could not stop TensorFlow profiler: {e}")
+	finally:
+		_profiler_lock.release()
+
+
+def _format_profile(trace: _RequestTrace) -> str:
+	buffer = io.StringIO()
+	stats = pstats.Stats(trace.profiler, *trace.thread_profilers, stream=buffer)
+	stats.sort_stats("cumulative").print_stats(_TOP_FUNCTIONS)
+	return buffer.getvalue()
+
+
+def _prune_ring_buffer() -> None:
+	"""Keep at most _MAX_TRACES traces on disk, dropping the oldest first."""
+	trace_dirs = sorted(
+		(p for p in _PROFILE_DIR.iterdir() if p.is_dir() and _TRACE_ID_RE.match(p.name)),
+		key=lambda p: int(p.name.split("-")[0]),
+	)
+	for stale in trace_dirs[:max(0, len(trace_dirs) - _MAX_TRACES)]:
+		shutil.rmtree(stale, ignore_errors=True)
+
+
+def _persist_trace(trace: _RequestTrace, total_ms: float, reason: str, error: Optional[str]) -> None:
+	trace_dir = _PROFILE_DIR / trace.trace_id
+	trace_dir.mkdir(parents=True, exist_ok=True)
+	doc = {
+		"id": trace.trace_id,
+		"endpoint": trace.endpoint,
+		"reason": reason,
+		"started_at": trace.started_at.isoformat(),
+		"total_ms": round(total_ms, 3),
+		"stages": trace.stages,
+		"stage_totals": trace.stage_totals(),
+		"meta": trace.meta,
+		"error": error,
+		"has_cprofile": trace.profiler is not None,
+		"tf_logdir": str(trace.tf_logdir) if trace.tf_logdir else None,
+	}
+	if trace.profiler is not None:
+		(trace_dir / "cprofile.txt").write_text(_format_profile(trace), encoding="utf-8")
+	(trace_dir / "trace.json").write_text(json.dumps(doc), encoding="utf-8")
+	with _ring_lock:
+		_prune_ring_buffer()
+
+
+@contextmanager
+def profile_request(endpoint: str, **meta: Any) -> Iterator[None]:
+	"""Trace one request: always time stages, sample a profiler, persist sampled/slow requests.
+
+	Nested calls and calls with profiling disabled are no-ops.
+	"""
+	if not is_enabled() or _current_trace.get() is not None:
+		yield
+		return
+
+	trace = _RequestTrace(endpoint, meta)
+	sampled = _SAMPLE_RATE > 0 and random.random() < _SAMPLE_RATE
+	if sampled:
+		_start_profilers(trace)
+	token = _current_trace.set(trace)
+	error: Optional[str] = None
+	try:
+		yield
+	except BaseException as e:
+		error = f"{type(e).__name__}: {e}"
+		raise
+	finally:
+		_current_trace.reset(token)
+		_stop_profilers(trace)
+		total_ms = (time.perf_counter() - trace.started) * 1000
+		is_slow = _SLOW_REQUEST_MS > 0 and total_ms >= _SLOW_REQUEST_MS
+		if sampled or is_slow:
+			try:
+				_persist_trace(trace, total_ms, "slow" if is_slow else "sampled", error)
+			except Exception as e:
+				print(f"[PROFILE] Could not persist trace {trace.trace_id}: {e}")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+	"""Record the wall time of a named stage on the current request trace, if any."""
+	trace = _current_trace.get()
+	if trace is None:
+		yield
+		return
+	started = time.perf_counter()
+	try:
+		yield
+	finally:
+		trace.add_stage(name, (time.perf_counter() - started) * 1000)
+
+
+def run_profiled(fn: Callable[..., Any], *args: Any) -> Any:
+	"""Call fn(*args), profiling it too when the current request is sampled.
+
+	cProfile only records the thread that enabled it, so work the request hands
+	to a worker thread is profiled there and merged into the request's report.
+	"""
+	trace = _current_trace.get()
+	if trace is None or trace.profiler is None:
+		return fn(*args)
+	profiler = cProfile.Profile()
+	try:
+		profiler.enable()
+	except ValueError:
+		# Python 3.12+ profiles every thread from one session; the request's already covers this one
+		return fn(*args)
+	try:
+		return fn(*args)
+	finally:
+		profiler.disable()
+		trace.thread_profilers.append(profiler)
+
+
+def list_traces(limit: int = 50) -> List[Dict[str, Any]]:
+	"""Return summaries of the most recent stored traces, newest first."""
+	if not _PROFILE_DIR.exists():
+		return []
+	trace_dirs = sorted(
+		(p for p in _PROFILE_DIR.iterdir() if p.is_dir() and _TRACE_ID_RE.match(p.name)),
+		key=lambda p: int(p.name.split("-")[0]),
+		reverse=True,
+	)
+	summaries = []
+	for trace_dir in trace_dirs[:limit]:
+		try:
+			doc = json.loads((trace_dir / "trace.json").read_text(encoding="utf-8"))
+		except (OSError, ValueError):
+			continue
+		summaries.append({
+			"id": doc["id"],
+			"endpoint": doc["endpoint"],
+			"reason": doc["reason"],
+			"started_at": doc["started_at"],
+			"total_ms": doc["total_ms"],
+			"stage_totals": doc["stage_totals"],
+			"has_cprofile": doc["has_cprofile"],
+		})
+	return summaries
+
+
+def get_trace(trace_id: str) -> Optional[Dict[str, Any]]:
+	"""Return a stored trace with its cProfile report, or None if unknown."""
+	if not _TRACE_ID_RE.match(trace_id):
+		return None
+	trace_dir = _PROFILE_DIR / trace_id
+	try:
+		doc = json.loads((trace_dir / "trace.json").read_text(encoding="utf-8"))
+	except (OSError, ValueError):
+		return None
+	cprofile_path = trace_dir / "cprofile.txt"
+	doc["cprofile"] = cprofile_path.read_text(encoding="utf-8") if cprofile_path.exists() else None
+	return doc
+
+
+def get_config() -> Dict[str, Any]:
+	"""Return the active profiling configuration."""
+	return {
+		"enabled": is_enabled(),
+		"sample_rate": _SAMPLE_RATE,
+		"tf_profiler": _TF_PROFILER,
+		"slow_request_ms": _SLOW_REQUEST_MS,
+		"max_traces": _MAX_TRACES,
+		"profile_dir": str(_PROFILE_DIR),
+	}
@@ -0,0 +1,270 @@
+import asyncio
+import io
+import os
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from fastapi import WebSocket
+from PIL import Image
+
+from database import check_duplicate, save_prediction
+from model import decode_image, get_embedding_model, predict_images
+from perceptual_hash import compute_dhash
+from scheduler import get_scheduler, INTERACTIVE, BULK
+
+_MAX_BATCH = int(os.getenv("WS_MAX_BATCH", "8"))
+_BATCH_WAIT_MS = float(os.getenv("WS_BATCH_WAIT_MS", "5"))
+_MAX_FRAME_BYTES = int(os.getenv("WS_MAX_FRAME_BYTES", str(2 * 1024 * 1024)))
+_MAX_FRAME_AGE_MS = float(os.getenv("WS_MAX_FRAME_AGE_MS", "1000"))
+DEFAULT_SMOOTHING_WINDOW = int(os.getenv("WS_SMOOTHING_WINDOW", "5"))
+DEFAULT_KEYFRAME_INTERVAL_S = float(os.getenv("WS_KEYFRAME_INTERVAL_S", "0"))
+
+
+class _Frame:
+	__slots__ = ("seq", "data", "received_at")
+
+	def __init__(self, seq: int, data: bytes):
+		self.seq = seq
+		self.data = data
+		self.received_at = time.perf_counter()
+
+
+class FrameStream:
+	"""State of one WebSocket connection: results outbox, label smoothing, keyframes and stats."""
+
+	def __init__(self, stream_id: str, smoothing_window: int, keyframe_interval_s: float):
+		self.id = stream_id
+		self.keyframe_interval_s = keyframe_interval_s
+		self.outbox: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+		self.received = 0
+		self.processed = 0
+		self.dropped = 0
+		self.keyframes = 0
+		self._latencies: deque = deque(maxlen=200)
+		self._history: deque = deque(maxlen=max(1, smoothing_window))
+		self._last_keyframe_at: Optional[float] = None
+		self._last_keyframe_label: Optional[str] = None
+
+	def smooth(self, label: str, confidence: float) -> Tuple[str, float]:
+		"""Confidence-weighted vote over the last smoothing_window frames."""
+		self._history.append((label, confidence))
+		scores: Dict[str, float] = {}
+		for past_label, past_confidence in self._history:
+			scores[past_label] = scores.get(past_label, 0.0) + past_confidence
+		best = max(scores, key=scores.get)
+		return best, round(scores[best] / len(self._history), 4)
+
+	def keyframe_due(self, label: str, now: float) -> bool:
+		"""A frame is persisted when the smoothed label changes or the interval has elapsed."""
+		if self.keyframe_interval_s <= 0:
+			return False
+		if self._last_keyframe_at is None or label != self._last_keyframe_label or now - self._last_keyframe_at >= self.keyframe_interval_s:
+			self._last_keyframe_at = now
+			self._last_keyframe_label = label
+			return True
+		return False
+
+	def record_latency(self, latency_ms: float) -> None:
+		self.processed += 1
+		self._latencies.append(latency_ms)
+
+	def stats(self) -> Dict[str, Any]:
+		latencies = list(self._latencies)
+		return {
+			"received": self.received,
+			"processed": self.processed,
+			"dropped": self.dropped,
+			"drop_rate": round(self.dropped / self.received, 4) if self.received else 0.0,
+			"keyframes": self.keyframes,
+			"latency_ms": {
+				"p50": round(float(np.percentile(latencies, 50)), 2) if latencies else None,
+				"p95": round(float(np.percentile(latencies, 95)), 2) if latencies else None,
+			},
+		}
+
+
+def _decode_frame(data: bytes) -> Image.Image:
+	# Check the header before decoding (decompression-bomb guard, as for uploads)
+	with Image.open(io.BytesIO(data)) as probe:
+		width, height = probe.size
+	if width * height > Image.MAX_IMAGE_PIXELS:
+		raise ValueError(f"frame exceeds the {Image.MAX_IMAGE_PIXELS} pixel limit")
+	return decode_image(data)
+
+
+def _classify_frames(frames: List[bytes]) -> List[Dict[str, Any]]:
+	"""Decode frames and classify the valid ones in a single model batch. Runs on a scheduler worker."""
+	outputs: List[Dict[str, Any]] = [{} for _ in frames]
+	images, indices = [], []
+	for i, data in enumerate(frames):
+		try:
+			image = _decode_frame(data)
+		except Exception as e:
+			outputs[i] = {"error": f"invalid frame: {e}"}
+			continue
+		outputs[i] = {"phash": compute_dhash(image)}
+		images.append(image)
+		indices.append(i)
+	if images:
+		for i, (result, embedding) in zip(indices, predict_images(images)):
+			outputs[i].update({"result": result, "embedding": embedding})
+	return outputs
+
+
+def _save_keyframe(stream_id: str, seq: int, data: bytes, output: Dict[str, Any]) -> str:
+	duplicate_info = check_duplicate(data, output["phash"])
+	result = output["result"]
+	prediction_id, _ = save_prediction(
+		f"ws_{stream_id}_{seq}.jpg",
+		data,
+		result["label"],
+		float(result["confidence"]),
+		result.get("tag"),
+		extra={"source": "websocket"},
+		image_phash=output["phash"],
+		embedding=output["embedding"],
+		embedding_model=get_embedding_model() if output["embedding"] is not None else None,
+		near_duplicate=duplicate_info if duplicate_info and duplicate_info["match_type"] == "near" else None,
+	)
+	return prediction_id
+
+
+class FrameBatcher:
+	"""Collects the latest frame of every connection and classifies them together.
+
+	Each connection has at most one pending frame: a newer frame replaces the
+	waiting one (counted as dropped), so when inference falls behind a stream
+	is always served its most recent frame. One batch runs at a time, in the
+	scheduler's interactive class.
+	"""
+
+	def __init__(self):
+		self._pending: Dict[str, Tuple[FrameStream, _Frame]] = {}
+		self._ready = asyncio.Event()
+		self._task: Optional[asyncio.Task] = None
+		# The event loop only keeps weak references to tasks; hold keyframe saves until done
+		self._persisting: Set[asyncio.Task] = set()
+
+	def offer(self, stream: FrameStream, frame: _Frame) -> None:
+		if stream.id in self._pending:
+			stream.dropped += 1
+		self._pending[stream.id] = (stream, frame)
+		self._ready.set()
+		if self._task is None or self._task.done():
+			self._task = asyncio.create_task(self._run())
+
+	def discard(self, stream: FrameStream) -> None:
+		self._pending.pop(stream.id, None)
+
+	def _take_batch(self) -> List[Tuple[FrameStream, _Frame]]:
+		batch = []
+		now = time.perf_counter()
+		for stream_id in list(self._pending)[:_MAX_BATCH]:
+			stream, frame = self._pending.pop(stream_id)
+			if (now - frame.received_at) * 1000 > _MAX_FRAME_AGE_MS:
+				stream.dropped += 1
+				continue
+			batch.append((stream, frame))
+		if not self._pending:
+			self._ready.clear()
+		return batch
+
+	async def _run(self) -> None:
+		scheduler = get_scheduler()
+		while True:
+			await self._ready.wait()
+			if _BATCH_WAIT_MS > 0 and len(self._pending) < _MAX_BATCH:
+				# Give other connections a moment to contribute to the batch
+				await asyncio.sleep(_BATCH_WAIT_MS / 1000)
+			batch = self._take_batch()
+			if not batch:
+				continue
+			try:
+				outputs = await scheduler.run(INTERACTIVE, "websocket", _classify_frames, [frame.data for _, frame in batch])
+			except Exception as e:
+				print(f"[WS] Batch of {len(batch)} frames failed: {e}")
+				for stream, frame in batch:
+					stream.outbox.put_nowait({"type": "error", "frame": frame.seq, "error": str(e)})
+				continue
+			for (stream, frame), output in zip(batch, outputs):
+				self._deliver(stream, frame, output)
+
+	def _deliver(self, stream: FrameStream, frame: _Frame, output: Dict[str, Any]) -> None:
+		now = time.perf_counter()
+		if "error" in output:
+			stream.outbox.put_nowait({"type": "error", "frame": frame.seq, "error": output["error"]})
+			return
+		result = output["result"]
+		latency_ms = (now - frame.received_at) * 1000
+		stream.record_latency(latency_ms)
+		smoothed_label, smoothed_confidence = stream.smooth(result["label"], result["confidence"])
+		keyframe = stream.keyframe_due(smoothed_label, now)
+		if keyframe:
+			stream.keyframes += 1
+		stream.outbox.put_nowait({
+			"type": "prediction",
+			"frame": frame.seq,
+			"result": result,
+			"smoothed": {"label": smoothed_label, "confidence": smoothed_confidence},
+			"latency_ms": round(latency_ms, 2),
+			"stats": stream.stats(),
+		})
+		if keyframe:
+			task = asyncio.create_task(self._persist(stream, frame, output))
+			self._persisting.add(task)
+			task.add_done_callback(self._persisting.discard)
+
+	@staticmethod
+	async def _persist(stream: FrameStream, frame: _Frame, output: Dict[str, Any]) -> None:
+		try:
+			prediction_id = await get_scheduler().run(BULK, stream.id, _save_keyframe, stream.id, frame.seq, frame.data, output)
+		except Exception as e:
+			print(f"[WS] Could not save keyframe {frame.seq} of {stream.id}: {e}")
+			return
+		stream.outbox.put_nowait({"type": "keyframe", "frame": frame.seq, "id": prediction_id})
+
+
+_batcher: Optional[FrameBatcher] = None
+
+
+def _get_batcher() -> FrameBatcher:
+	global _batcher
+	if _batcher is None:
+		_batcher = FrameBatcher()
+	return _batcher
+
+
+async def _send_loop(websocket: WebSocket, stream: FrameStream) -> None:
+	while True:
+		message = await stream.outbox.get()
+		await websocket.send_json(message)
+
+
+async def serve_frame_stream(websocket: WebSocket, stream_id: str, smoothing_window: int, keyframe_interval_s: float) -> None:
+	"""Receive binary image frames on a WebSocket and stream back JSON predictions."""
+	await websocket.accept()
+	stream = FrameStream(stream_id, smoothing_window, keyframe_interval_s)
+	batcher = _get_batcher()
+	sender = asyncio.create_task(_send_loop(websocket, stream))
+	try:
+		while True:
+			message = await websocket.receive()
+			if message["type"] == "websocket.disconnect":
+				break
+			data = message.get("bytes")
+			if data is None:
+				# Text messages are control messages; "stats" asks for the counters
+				if message.get("text") == "stats":
+					stream.outbox.put_nowait({"type": "stats", "stats": stream.stats()})
+				continue
+			if len(data) > _MAX_FRAME_BYTES:
+				await websocket.close(code=1009, reason=f"Frame exceeds {_MAX_FRAME_BYTES} bytes")
+				break
+			stream.received += 1
+			batcher.offer(stream, _Frame(stream.received, data))
+	finally:
+		batcher.discard(stream)
+		sender.cancel()
+		print(f"[WS] Stream {stream_id} closed: {stream.stats()}")
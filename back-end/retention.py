@@ -0,0 +1,218 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from database import archive_predictions, collection_size, compact_predictions
+from export import write_parquet
+
+# Max age in days per class of record; 0 keeps records forever
+_RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "0"))
+# Duplicate records hold no image and can usually go sooner; defaults to RETENTION_DAYS
+_RETENTION_DUPLICATE_DAYS = float(os.getenv("RETENTION_DUPLICATE_DAYS", str(_RETENTION_DAYS)))
+# Per-label overrides, e.g. "apple=30,banana=365"
+_RETENTION_LABEL_DAYS = os.getenv("RETENTION_LABEL_DAYS", "")
+
+_ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", str(Path(__file__).parent / "archive")))
+_ARCHIVE_INTERVAL_S = float(os.getenv("ARCHIVE_INTERVAL_S", "3600"))
+_ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# "true"/"false" overrides the mount-point check for ARCHIVE_DIR
+_ARCHIVE_PERSISTENT = os.getenv("ARCHIVE_PERSISTENT", "").strip().lower()
+
+_run_lock = threading.Lock()
+_last_runs: Dict[str, Optional[Dict[str, Any]]] = {"archive": None, "compaction": None}
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+class RetentionPolicy:
+	"""Records matching query are archived once older than max_age_days."""
+
+	__slots__ = ("name", "max_age_days", "query")
+
+	def __init__(self, name: str, max_age_days: float, query: Dict[str, Any]):
+		self.name = name
+		self.max_age_days = max_age_days
+		self.query = query
+
+	def expired_query(self, now: datetime) -> Dict[str, Any]:
+		cutoff = now - timedelta(days=self.max_age_days)
+		return {**self.query, "created_at": {"$lt": cutoff}}
+
+	def describe(self) -> Dict[str, Any]:
+		return {"name": self.name, "max_age_days": self.max_age_days}
+
+
+def _parse_label_days(value: str) -> Dict[str, float]:
+	label_days = {}
+	for item in value.split(","):
+		if not item.strip():
+			continue
+		label, _, days = item.partition("=")
+		try:
+			label_days[label.strip()] = float(days)
+		except ValueError:
+			print(f"[RETENTION] Ignoring invalid RETENTION_LABEL_DAYS entry: {item!r}")
+	return label_days
+
+
+def get_policies() -> List[RetentionPolicy]:
+	"""Build the configured policies; each record falls under exactly one.
+
+	Precedence: a label override, then the duplicate policy, then the default.
+	"""
+	label_days = _parse_label_days(_RETENTION_LABEL_DAYS)
+	policies = [
+		RetentionPolicy(f"label:{label}", days, {"predicted_label": label})
+		for label, days in label_days.items() if days > 0
+	]
+	others: Dict[str, Any] = {"predicted_label": {"$nin": list(label_days)}} if label_days else {}
+	is_duplicate = {"duplicate_of": {"$exists": True}}
+	if _RETENTION_DUPLICATE_DAYS > 0:
+		policies.append(RetentionPolicy("duplicates", _RETENTION_DUPLICATE_DAYS, {**others, **is_duplicate}))
+	if _RETENTION_DAYS > 0:
+		# Duplicates follow their own policy, even when it keeps them forever
+		policies.append(RetentionPolicy("default", _RETENTION_DAYS, {**others, "duplicate_of": {"$exists": False}}))
+	return policies
+
+
+def _archive_policy(policy: RetentionPolicy, now: datetime) -> Dict[str, Any]:
+	directory = _ARCHIVE_DIR / policy.name.replace(":", "_")
+	directory.mkdir(parents=True, exist_ok=True)
+	stamp = now.strftime("%Y%m%dT%H%M%SZ")
+	files: List[str] = []
+	written = 0
+
+	def write_batch(records: Iterable[Dict[str, Any]]) -> None:
+		nonlocal written
+		path = directory / f"predictions-{stamp}-{len(files):05d}.parquet"
+		written += write_parquet(records, path)
+		files.append(str(path))
+
+	archived = archive_predictions(policy.expired_query(now), write_batch, batch_size=_ARCHIVE_BATCH_SIZE)
+	return {**policy.describe(), "archived": archived, "files": files, "archive_bytes": written}
+
+
+def _in_container() -> bool:
+	return Path("/.dockerenv").exists() or Path("/run/.containerenv").exists()
+
+
+def archive_is_persistent() -> bool:
+	"""Whether ARCHIVE_DIR survives the process's container.
+
+	Inside a container the directory (or a parent below /) must be a mounted
+	volume; otherwise archived records would vanish with the container's
+	writable layer after being deleted from MongoDB. ARCHIVE_PERSISTENT
+	overrides the check either way.
+	"""
+	if _ARCHIVE_PERSISTENT in ("1", "true", "yes"):
+		return True
+	if _ARCHIVE_PERSISTENT in ("0", "false", "no"):
+		return False
+	if not _in_container():
+		return True
+	path = _ARCHIVE_DIR.resolve()
+	for directory in (path, *path.parents):
+		if directory == Path(directory.anchor):
+			break
+		if os.path.ismount(directory):
+			return True
+	return False
+
+
+@contextmanager
+def _exclusive():
+	"""Allow one archive or compaction run at a time; fail fast instead of queueing."""
+	if not _run_lock.acquire(blocking=False):
+		raise RuntimeError("A retention job is already running")
+	try:
+		yield
+	finally:
+		_run_lock.release()
+
+
+def run_archive() -> Dict[str, Any]:
+	"""Move every record past its policy's age into compressed Parquet files under ARCHIVE_DIR.
+
+	Refuses to run (RuntimeError) when ARCHIVE_DIR is not on persistent storage,
+	since archived records are deleted from MongoDB.
+	"""
+	if not archive_is_persistent():
+		raise RuntimeError(
+			f"ARCHIVE_DIR {_ARCHIVE_DIR} is not on a mounted volume; archiving would delete records "
+			"whose only copy is lost with the container. Mount a volume there or set ARCHIVE_PERSISTENT=true"
+		)
+	with _exclusive():
+		started = time.perf_counter()
+		now = datetime.now(timezone.utc)
+		before = collection_size()
+		policies = [_archive_policy(policy, now) for policy in get_policies()]
+		after = collection_size()
+		report = {
+			"finished_at": datetime.now(timezone.utc).isoformat(),
+			"duration_s": round(time.perf_counter() - started, 2),
+			"archived": sum(p["archived"] for p in policies),
+			"policies": policies,
+			"before": before,
+			"after": after,
+			"reclaimed_data_bytes": max(0, before["data_bytes"] - after["data_bytes"]),
+		}
+		_last_runs["archive"] = report
+		return report
+
+
+def run_compaction(release_space: bool = False) -> Dict[str, Any]:
+	"""Re-point or unlink orphaned duplicates and drop redundant image copies."""
+	with _exclusive():
+		started = time.perf_counter()
+		report = compact_predictions(batch_size=_ARCHIVE_BATCH_SIZE, release_space=release_space)
+		report["finished_at"] = datetime.now(timezone.utc).isoformat()
+		report["duration_s"] = round(time.perf_counter() - started, 2)
+		_last_runs["compaction"] = report
+		return report
+
+
+def status() -> Dict[str, Any]:
+	return {
+		"policies": [policy.describe() for policy in get_policies()],
+		"archive_dir": str(_ARCHIVE_DIR),
+		"archive_persistent": archive_is_persistent(),
+		"interval_s": _ARCHIVE_INTERVAL_S,
+		"background": _thread is not None and _thread.is_alive(),
+		"running": _run_lock.locked(),
+		"last_runs": dict(_last_runs),
+	}
+
+
+def _background_loop() -> None:
+	while not _stop.wait(_ARCHIVE_INTERVAL_S):
+		try:
+			if archive_is_persistent():
+				report = run_archive()
+				print(f"[RETENTION] Archived {report['archived']} records in {report['duration_s']}s")
+			else:
+				print(f"[RETENTION] Skipping archive: {_ARCHIVE_DIR} is not on a mounted volume (see ARCHIVE_PERSISTENT)")
+			report = run_compaction()
+			print(f"[RETENTION] Compaction: {report['orphans_repointed']} re-pointed, {report['orphans_unlinked']} unlinked, "
+				f"{report['images_deduplicated']} duplicate images dropped, {report['reclaimed_data_bytes']} bytes reclaimed")
+		except Exception as e:
+			print(f"[RETENTION] Background run failed: {e}")
+
+
+def start_background_archiver() -> bool:
+	"""Start the periodic archive + compaction thread when a policy is configured."""
+	global _thread
+	if _ARCHIVE_INTERVAL_S <= 0 or not get_policies():
+		return False
+	if _thread is None or not _thread.is_alive():
+		_stop.clear()
+		_thread = threading.Thread(target=_background_loop, name="retention-archiver", daemon=True)
+		_thread.start()
+	return True
+
+
+def stop_background_archiver() -> None:
+	_stop.set()
@@ -0,0 +1,236 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+import numpy as np
+
+from profiling import run_profiled
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+# Bulk work never occupies every worker, so an interactive request waits for at most one in-flight item
+_BULK_MAX_WORKERS = int(os.getenv("BULK_MAX_WORKERS", str(max(1, _WORKERS - 1))))
+_WEIGHTS = {
+	INTERACTIVE: float(os.getenv("INTERACTIVE_WEIGHT", "8")),
+	BULK: float(os.getenv("BULK_WEIGHT", "1")),
+}
+_PER_CLIENT_LIMIT = {
+	INTERACTIVE: int(os.getenv("INTERACTIVE_PER_CLIENT", "4")),
+	BULK: int(os.getenv("BULK_PER_CLIENT", "1")),
+}
+_BULK_DEADLINE_S = float(os.getenv("BULK_DEADLINE_S", "120"))
+
+
+class SchedulerShed(RuntimeError):
+	"""Raised for work that was still queued when its deadline passed."""
+
+
+class _WorkItem:
+	__slots__ = ("priority", "client_id", "fn", "args", "context", "future", "loop", "enqueued_at", "ready_at", "deadline_s")
+
+	def __init__(self, priority, client_id, fn, args, future, loop, deadline_s):
+		self.priority = priority
+		self.client_id = client_id
+		self.fn = fn
+		self.args = args
+		# Run with the submitter's context vars (e.g. the profiling trace)
+		self.context = contextvars.copy_context()
+		self.future = future
+		self.loop = loop
+		self.enqueued_at = time.monotonic()
+		# Set once only other clients' work stands between this item and a worker
+		self.ready_at: Optional[float] = None
+		self.deadline_s = deadline_s
+
+	def mark_ready(self) -> None:
+		if self.ready_at is None:
+			self.ready_at = time.monotonic()
+
+	def is_expired(self, now: float) -> bool:
+		return bool(self.deadline_s) and self.ready_at is not None and now - self.ready_at > self.deadline_s
+
+
+class InferenceScheduler:
+	"""Runs blocking inference work on a worker pool with two priority classes.
+
+	- Weighted fair sharing: each class has a virtual time advanced by 1/weight
+	  per item started; the backlogged class with the lowest virtual time goes
+	  next, so interactive work gets INTERACTIVE_WEIGHT slots per bulk slot.
+	- Bulk items may use at most BULK_MAX_WORKERS of the INFERENCE_WORKERS threads.
+	- Per-client concurrency: within a class, clients are served round-robin and
+	  a client never has more than its class limit of items running at once.
+	- Deadline-aware shedding: a bulk item that could have started BULK_DEADLINE_S
+	  ago but for other clients' work fails with SchedulerShed instead of running
+	  for a caller that has likely given up. The clock only starts once the
+	  client's own earlier items are out of the way, so a single large batch on
+	  an otherwise idle server is never shed.
+	"""
+
+	def __init__(self, workers: int = _WORKERS, bulk_max_workers: int = _BULK_MAX_WORKERS):
+		self.workers = max(1, workers)
+		self.class_max_workers = {INTERACTIVE: self.workers, BULK: max(1, min(bulk_max_workers, self.workers))}
+		self._cond = threading.Condition()
+		# class -> client_id -> queued items; OrderedDict order is the round-robin order
+		self._queues: Dict[str, "OrderedDict[str, Deque[_WorkItem]]"] = {INTERACTIVE: OrderedDict(), BULK: OrderedDict()}
+		self._running: Dict[str, int] = {INTERACTIVE: 0, BULK: 0}
+		self._running_per_client: Dict[tuple, int] = {}
+		self._virtual_time: Dict[str, float] = {INTERACTIVE: 0.0, BULK: 0.0}
+		self._waits: Dict[str, Deque[float]] = {INTERACTIVE: deque(maxlen=2000), BULK: deque(maxlen=2000)}
+		self._counters: Dict[str, Dict[str, int]] = {c: {"submitted": 0, "completed": 0, "shed": 0, "failed": 0} for c in (INTERACTIVE, BULK)}
+		self._threads = [
+			threading.Thread(target=self._worker, name=f"inference-worker-{i}", daemon=True)
+			for i in range(self.workers)
+		]
+		for thread in self._threads:
+			thread.start()
+
+	async def run(self, priority: str, client_id: str, fn: Callable[..., Any], *args: Any, deadline_s: Optional[float] = None) -> Any:
+		"""Queue fn(*args) under a priority class and await its result."""
+		if priority not in self._queues:
+			raise ValueError(f"Unknown priority class: {priority}")
+		if deadline_s is None and priority == BULK:
+			deadline_s = _BULK_DEADLINE_S
+		loop = asyncio.get_running_loop()
+		future = loop.create_future()
+		item = _WorkItem(priority, client_id, fn, args, future, loop, deadline_s)
+		with self._cond:
+			self._counters[priority]["submitted"] += 1
+			queues = self._queues[priority]
+			if not any(queues.values()):
+				# A class coming back from idle must not cash in time it did not use
+				self._virtual_time[priority] = max(self._virtual_time[priority], self._min_active_virtual_time())
+			queues.setdefault(client_id, deque()).append(item)
+			self._mark_ready(priority, client_id)
+			self._cond.notify()
+		return await future
+
+	def _min_active_virtual_time(self) -> float:
+		active = [self._virtual_time[c] for c, q in self._queues.items() if any(q.values())]
+		return min(active) if active else 0.0
+
+	def _mark_ready(self, priority: str, client_id: str) -> None:
+		"""Start the deadline of a client's next item once the client is below its concurrency limit."""
+		items = self._queues[priority].get(client_id)
+		if items and self._running_per_client.get((priority, client_id), 0) < _PER_CLIENT_LIMIT[priority]:
+			items[0].mark_ready()
+
+	def _eligible_client(self, priority: str) -> Optional[str]:
+		if self._running[priority] >= self.class_max_workers[priority]:
+			return None
+		limit = _PER_CLIENT_LIMIT[priority]
+		for client_id, items in self._queues[priority].items():
+			if items and self._running_per_client.get((priority, client_id), 0) < limit:
+				return client_id
+		return None
+
+	def _next_item(self) -> Optional[_WorkItem]:
+		"""Pick the next runnable item; caller holds the condition lock."""
+		candidates = []
+		for priority in (INTERACTIVE, BULK):
+			client_id = self._eligible_client(priority)
+			if client_id is not None:
+				candidates.append((self._virtual_time[priority], priority, client_id))
+		if not candidates:
+			return None
+		_, priority, client_id = min(candidates)
+		queues = self._queues[priority]
+		item = queues[client_id].popleft()
+		# Rotate the client to the back for round-robin; drop it once drained
+		queues.move_to_end(client_id)
+		if not queues[client_id]:
+			del queues[client_id]
+		self._virtual_time[priority] += 1.0 / _WEIGHTS[priority]
+		return item
+
+	def _worker(self) -> None:
+		while True:
+			with self._cond:
+				item = self._next_item()
+				while item is None:
+					self._cond.wait()
+					item = self._next_item()
+				key = (item.priority, item.client_id)
+				self._running[item.priority] += 1
+				self._running_per_client[key] = self._running_per_client.get(key, 0) + 1
+				self._mark_ready(*key)
+				waited = time.monotonic() - item.enqueued_at
+				self._waits[item.priority].append(waited * 1000)
+
+			try:
+				if item.future.cancelled():
+					continue
+				if item.is_expired(time.monotonic()):
+					self._count(item.priority, "shed")
+					self._resolve(item, exception=SchedulerShed(f"Dropped after waiting {waited:.1f}s in the {item.priority} queue"))
+					continue
+				try:
+					result = item.context.run(run_profiled, item.fn, *item.args)
+				except BaseException as e:
+					self._count(item.priority, "failed")
+					self._resolve(item, exception=e)
+				else:
+					self._count(item.priority, "completed")
+					self._resolve(item, result=result)
+			finally:
+				with self._cond:
+					self._running[item.priority] -= 1
+					self._running_per_client[key] -= 1
+					if not self._running_per_client[key]:
+						del self._running_per_client[key]
+					self._mark_ready(*key)
+					self._cond.notify_all()
+
+	def _count(self, priority: str, name: str) -> None:
+		with self._cond:
+			self._counters[priority][name] += 1
+
+	@staticmethod
+	def _resolve(item: _WorkItem, result: Any = None, exception: Optional[BaseException] = None) -> None:
+		def _set():
+			if item.future.done():
+				return
+			if exception is not None:
+				item.future.set_exception(exception)
+			else:
+				item.future.set_result(result)
+		item.loop.call_soon_threadsafe(_set)
+
+	def stats(self) -> Dict[str, Any]:
+		with self._cond:
+			result: Dict[str, Any] = {"workers": self.workers}
+			for priority in (INTERACTIVE, BULK):
+				waits = list(self._waits[priority])
+				result[priority] = {
+					"weight": _WEIGHTS[priority],
+					"max_workers": self.class_max_workers[priority],
+					"per_client_limit": _PER_CLIENT_LIMIT[priority],
+					"queued": sum(len(items) for items in self._queues[priority].values()),
+					"queued_clients": len(self._queues[priority]),
+					"running": self._running[priority],
+					**self._counters[priority],
+					"queue_wait_ms": {
+						"p50": round(float(np.percentile(waits, 50)), 2) if waits else None,
+						"p99": round(float(np.percentile(waits, 99)), 2) if waits else None,
+					},
+				}
+			return result
+
+
+_scheduler: Optional[InferenceScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> InferenceScheduler:
+	"""Get the process-wide scheduler, starting its workers on first use."""
+	global _scheduler
+	if _scheduler is None:
+		with _scheduler_lock:
+			if _scheduler is None:
+				_scheduler = InferenceScheduler()
+	return _scheduler
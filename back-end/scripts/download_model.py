@@ -1,35 +1,312 @@
+"""Fetch model weights and their label files, verified against a SHA-256 manifest.
+
+Files are streamed to a temp file in a content-addressed cache and resumed with
+HTTP Range requests after an interruption. The response's ETag or Last-Modified
+is kept next to the temp file and sent as If-Range, so a file that changed on the
+server is downloaded again instead of spliced; a file without a SHA-256 is never
+resumed without such a validator. Only a file whose SHA-256 matches the
+manifest is moved into the cache, and the model directory gets it via an atomic
+rename, so the backend never picks up a partial or corrupt .h5.
+
+Manifest (JSON, local path or URL; relative URLs resolve against its URL or --base-url):
+
+    {"files": [
+        {"name": "fruit_classifier_mobilenetv2.h5", "url": "fruit_classifier_mobilenetv2.h5",
+         "sha256": "9f2c...", "size": 14238720},
+        {"name": "fruit_classifier_mobilenetv2.labels.txt", "url": "fruit_classifier_mobilenetv2.labels.txt",
+         "sha256": "51d0..."}
+    ]}
+
+A model without a labels entry gets the .labels.txt next to its URL, unverified.
+
+Usage:
+    python scripts/download_model.py --manifest https://example.com/models/manifest.json
+    MODEL_URL=https://example.com/model.h5 MODEL_SHA256=9f2c... python scripts/download_model.py
+    python scripts/download_model.py --hash ../model/*.h5 ../model/*.labels.txt   # print a manifest
+"""
+import argparse
+import hashlib
+import json
 import os
+import sys
+import time
 from pathlib import Path
-from urllib.parse import urlparse
+from typing import Dict, List, Optional
+from urllib.parse import urljoin, urlparse
 
 import requests
 
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_MODEL_DIR = Path(__file__).resolve().parent.parent.parent / "model"
+LABELS_SUFFIX = ".labels.txt"
+
+
+class ChecksumError(RuntimeError):
+    """The downloaded bytes do not match the manifest's SHA-256."""
+
+
+def _sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fsync_replace(source: Path, destination: Path) -> None:
+    with open(source, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(source, destination)
+
+
+def _validator_path(partial: Path) -> Path:
+    return partial.with_suffix(".validator")
+
+
+def _save_validator(partial: Path, response: requests.Response) -> None:
+    """Remember the response's strong ETag, else its Last-Modified, for If-Range on resume."""
+    etag = response.headers.get("ETag")
+    validator = etag if etag and not etag.startswith("W/") else response.headers.get("Last-Modified")
+    if validator:
+        _validator_path(partial).write_text(validator, encoding="utf-8")
+    else:
+        _validator_path(partial).unlink(missing_ok=True)
+
+
+def _discard_partial(partial: Path) -> None:
+    partial.unlink(missing_ok=True)
+    _validator_path(partial).unlink(missing_ok=True)
+
+
+def _labels_name(model_name: str) -> str:
+    return Path(model_name).stem + LABELS_SUFFIX
+
+
+def _is_http(url: str) -> bool:
+    return urlparse(url).scheme in ("http", "https")
+
 
-def download_model():
-    model_url = os.getenv("MODEL_URL")
-    if not model_url:
-        raise RuntimeError(
-            "MODEL_URL environment variable is not set. "
-            "Provide a direct download URL for the model file."
-        )
+def load_manifest(source: str, session: requests.Session, base_url: Optional[str] = None) -> List[Dict]:
+    """Read a manifest from a path or URL; return its entries with absolute URLs.
 
-    # Determine filename from URL path
-    parsed = urlparse(model_url)
-    filename = Path(parsed.path).name or "model.h5"
+    Relative URLs resolve against base_url, else against the manifest's own URL.
+    """
+    if _is_http(source):
+        response = session.get(source, timeout=30)
+        response.raise_for_status()
+        manifest = response.json()
+        base_url = base_url or source
+    else:
+        manifest = json.loads(Path(source).read_text(encoding="utf-8"))
 
-    model_dir = Path(__file__).resolve().parent.parent / "model"
+    entries = []
+    for entry in manifest["files"]:
+        if "name" not in entry or "url" not in entry:
+            raise ValueError(f"Manifest entry needs 'name' and 'url': {entry}")
+        if Path(entry["name"]).name != entry["name"]:
+            raise ValueError(f"Manifest file name must not contain a path: {entry['name']}")
+        url = urljoin(base_url, entry["url"]) if base_url else entry["url"]
+        if not _is_http(url):
+            raise ValueError(f"{entry['name']}: relative URL {entry['url']!r} in a local manifest needs --base-url")
+        entries.append({**entry, "url": url})
+
+    # Models listed without their labels file get the one next to them
+    names = {entry["name"] for entry in entries}
+    for entry in list(entries):
+        if entry["name"].endswith((".h5", ".tflite")) and _labels_name(entry["name"]) not in names:
+            labels_url = urljoin(entry["url"], _labels_name(Path(urlparse(entry["url"]).path).name))
+            entries.append({"name": _labels_name(entry["name"]), "url": labels_url, "optional": True})
+    return entries
+
+
+class ModelCache:
+    """Files stored under their SHA-256: <root>/sha256/<digest>, with resumable temp files in <root>/partial."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.blobs = root / "sha256"
+        self.partial = root / "partial"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.partial.mkdir(parents=True, exist_ok=True)
+
+    def blob(self, sha256: str) -> Path:
+        return self.blobs / sha256
+
+    def partial_path(self, key: str) -> Path:
+        return self.partial / f"{key}.partial"
+
+    def fetch(self, url: str, sha256: Optional[str], session: requests.Session, retries: int = 5, expected_size: Optional[int] = None) -> Path:
+        """Download url into the cache unless a blob with this SHA-256 is already there; return the blob path."""
+        if sha256:
+            sha256 = sha256.lower()
+            if self.blob(sha256).exists():
+                print(f"  cached {sha256[:12]}")
+                return self.blob(sha256)
+        # Unverified downloads are keyed by URL so they can still resume
+        partial = self.partial_path(sha256 or hashlib.sha256(url.encode()).hexdigest())
+
+        resumed = partial.exists()
+        verified = bool(sha256)
+        self._download_with_retries(url, partial, session, retries, expected_size, verified)
+        actual = _sha256_file(partial)
+        if sha256 and actual != sha256 and resumed:
+            # The leftover partial file may be from another version: start from scratch once
+            print("  checksum mismatch after resuming; downloading again from the start")
+            _discard_partial(partial)
+            self._download_with_retries(url, partial, session, retries, expected_size, verified)
+            actual = _sha256_file(partial)
+        if sha256 and actual != sha256:
+            # Corrupt, or the file changed on the server: never resume from it
+            _discard_partial(partial)
+            raise ChecksumError(f"{url}: SHA-256 is {actual}, manifest says {sha256}")
+        blob = self.blob(actual)
+        _fsync_replace(partial, blob)
+        _validator_path(partial).unlink(missing_ok=True)
+        return blob
+
+    @staticmethod
+    def _download_with_retries(url: str, partial: Path, session: requests.Session, retries: int, expected_size: Optional[int], verified: bool) -> None:
+        for attempt in range(1, retries + 1):
+            try:
+                _download(url, partial, session, expected_size, verified)
+                return
+            except requests.RequestException as e:
+                if attempt == retries or (isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code < 500):
+                    raise
+                wait = min(30, 2 ** attempt)
+                print(f"  interrupted ({e}); resuming in {wait}s [{attempt}/{retries}]")
+                time.sleep(wait)
+
+
+def _download(url: str, partial: Path, session: requests.Session, expected_size: Optional[int], verified: bool = True) -> None:
+    """Stream url into partial, continuing from its current size with a Range request.
+
+    The Range is conditional on the validator saved with partial (If-Range), so
+    the server sends the whole file again if it changed. Without a validator a
+    partial file is only resumed when verified (a SHA-256 will check the result).
+    """
+    offset = partial.stat().st_size if partial.exists() else 0
+    validator_path = _validator_path(partial)
+    validator = validator_path.read_text(encoding="utf-8").strip() if validator_path.exists() else None
+    if offset and not validator and not verified:
+        print("  no ETag or Last-Modified saved for the partial file and no sha256 to check it; starting over")
+        offset = 0
+    if expected_size is not None and offset == expected_size:
+        return
+    # Byte ranges must refer to the file itself, not a compressed transfer of it
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        if validator:
+            headers["If-Range"] = validator
+    with session.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+        if response.status_code == 416 and offset:
+            # Requested range starts at the end: the partial file is already complete
+            return
+        response.raise_for_status()
+        if offset and response.status_code != 206:
+            print("  file changed on the server or Range not supported; starting over")
+            offset = 0
+        if not offset:
+            _save_validator(partial, response)
+        total = response.headers.get("Content-Length")
+        total = int(total) + offset if total is not None else expected_size
+        if offset:
+            print(f"  resuming at {offset / (1024 * 1024):.1f} MiB")
+        received = offset
+        last_report = time.monotonic()
+        with open(partial, "ab" if offset else "wb") as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                received += len(chunk)
+                if time.monotonic() - last_report > 2:
+                    last_report = time.monotonic()
+                    progress = f"{received / total:.0%}" if total else f"{received / (1024 * 1024):.1f} MiB"
+                    print(f"  {progress}")
+        if total is not None and received < total:
+            raise requests.ConnectionError(f"connection closed after {received} of {total} bytes")
+
+
+def install(blob: Path, destination: Path) -> None:
+    """Atomically place a cached blob at destination (hard link if possible, else copy)."""
+    if destination.exists() and destination.stat().st_ino == blob.stat().st_ino:
+        return
+    # The temp name must not end in .h5, or the backend could load it half-written
+    temp = destination.with_name(f".{destination.name}.partial")
+    if temp.exists():
+        temp.unlink()
+    try:
+        os.link(blob, temp)
+    except OSError:
+        with open(blob, "rb") as src, open(temp, "wb") as dst:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                dst.write(chunk)
+    _fsync_replace(temp, destination)
+
+
+def fetch_models(entries: List[Dict], model_dir: Path, cache: ModelCache, session: requests.Session, retries: int = 5) -> List[Path]:
+    """Download, verify and install every manifest entry; return the installed paths."""
     model_dir.mkdir(parents=True, exist_ok=True)
+    installed = []
+    for entry in entries:
+        print(f"{entry['name']} <- {entry['url']}")
+        sha256 = entry.get("sha256")
+        if not sha256:
+            print("  WARNING: no sha256 in manifest, file is not verified")
+        try:
+            blob = cache.fetch(entry["url"], sha256, session, retries, entry.get("size"))
+        except requests.HTTPError as e:
+            if entry.get("optional") and e.response is not None and e.response.status_code == 404:
+                print("  not found, skipping")
+                continue
+            raise
+        destination = model_dir / entry["name"]
+        install(blob, destination)
+        installed.append(destination)
+        print(f"  installed {destination} (sha256 {blob.name[:12]})")
+    return installed
 
-    destination = model_dir / filename
 
-    print(f"Downloading model from {model_url}")
-    response = requests.get(model_url, timeout=60)
-    response.raise_for_status()
+def print_manifest(paths: List[Path]) -> None:
+    files = [{"name": path.name, "url": path.name, "sha256": _sha256_file(path), "size": path.stat().st_size} for path in paths]
+    print(json.dumps({"files": files}, indent=2))
 
-    destination.write_bytes(response.content)
-    print(f"Model saved to {destination}")
 
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", default=os.getenv("MODEL_MANIFEST"), help="Manifest path or URL (env MODEL_MANIFEST)")
+    parser.add_argument("--base-url", help="Base for relative URLs in a local manifest")
+    parser.add_argument("--model-dir", type=Path, default=Path(os.getenv("MODEL_DIR", str(DEFAULT_MODEL_DIR))))
+    parser.add_argument("--cache-dir", type=Path, default=None, help="Content-addressed cache (default: <model-dir>/.cache, env MODEL_CACHE_DIR)")
+    parser.add_argument("--retries", type=int, default=5, help="Resume attempts per file")
+    parser.add_argument("--hash", nargs="+", type=Path, metavar="FILE", help="Print a manifest for local files and exit")
+    args = parser.parse_args()
 
-if __name__ == "__main__":
-    download_model()
+    if args.hash:
+        print_manifest(args.hash)
+        return
+
+    session = requests.Session()
+    if args.manifest:
+        entries = load_manifest(args.manifest, session, args.base_url)
+    elif os.getenv("MODEL_URL"):
+        # Single-file mode, kept for existing deployments
+        model_url = os.environ["MODEL_URL"]
+        name = Path(urlparse(model_url).path).name or "model.h5"
+        entries = [
+            {"name": name, "url": model_url, "sha256": os.getenv("MODEL_SHA256")},
+            {"name": _labels_name(name), "url": urljoin(model_url, _labels_name(name)), "sha256": os.getenv("MODEL_LABELS_SHA256"), "optional": True},
+        ]
+    else:
+        parser.error("Provide --manifest (or MODEL_MANIFEST), or MODEL_URL with MODEL_SHA256")
+
+    cache = ModelCache(args.cache_dir or Path(os.getenv("MODEL_CACHE_DIR", str(args.model_dir / ".cache"))))
+    try:
+        fetch_models(entries, args.model_dir, cache, session, args.retries)
+    except (ChecksumError, requests.RequestException, ValueError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
 
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Report the throughput gain vs. accuracy loss of cascaded inference.
+
+Runs both models over a labeled image folder (one sub-folder per class, as in the
+training dataset's test split) and, for a range of confidence thresholds, prints
+how many images the fast model would answer alone, the cascade's accuracy against
+the full model's, and the expected throughput.
+
+Usage:
+    python scripts/evaluate_cascade.py --fast ../model/fruit_classifier_mobilenetv2.h5 \
+        --full ../model/fruit_classifier_efficientnet.h5 --data ../dataset/test
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# Both models come from the command line; skip loading the server's model on import
+os.environ["MODEL_EAGER_LOAD"] = "false"
+
+from model import decode_image, load_model_from_path  # noqa: E402
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+DEFAULT_THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 0.99]
+
+
+def _iter_dataset(data_dir: Path):
+    for class_dir in sorted(p for p in data_dir.iterdir() if p.is_dir()):
+        for image_path in sorted(class_dir.iterdir()):
+            if image_path.suffix.lower() in IMAGE_SUFFIXES:
+                yield image_path, class_dir.name
+
+
+def _timed_predict(loaded, image):
+    started = time.perf_counter()
+    result, _ = loaded.predict(image)
+    return result, time.perf_counter() - started
+
+
+def evaluate(fast_path: Path, full_path: Path, data_dir: Path, thresholds, limit=None):
+    fast = load_model_from_path(fast_path)
+    full = load_model_from_path(full_path)
+
+    rows = []
+    for i, (image_path, true_label) in enumerate(_iter_dataset(data_dir)):
+        if limit is not None and i >= limit:
+            break
+        try:
+            image = decode_image(image_path.read_bytes())
+        except Exception as e:
+            print(f"Skipping {image_path}: {e}")
+            continue
+        fast_result, fast_seconds = _timed_predict(fast, image)
+        full_result, full_seconds = _timed_predict(full, image)
+        truth = true_label.strip().lower()
+        rows.append({
+            "fast_confidence": fast_result["confidence"],
+            "fast_correct": fast_result["label"].strip().lower() == truth,
+            "full_correct": full_result["label"].strip().lower() == truth,
+            "fast_seconds": fast_seconds,
+            "full_seconds": full_seconds,
+        })
+
+    if not rows:
+        raise RuntimeError(f"No images found under {data_dir}")
+
+    fast_confidence = np.array([r["fast_confidence"] for r in rows])
+    fast_correct = np.array([r["fast_correct"] for r in rows])
+    full_correct = np.array([r["full_correct"] for r in rows])
+    # Median latencies are robust to the first, warm-up calls
+    fast_latency = float(np.median([r["fast_seconds"] for r in rows]))
+    full_latency = float(np.median([r["full_seconds"] for r in rows]))
+
+    report = []
+    for threshold in thresholds:
+        answered_fast = fast_confidence >= threshold
+        cascade_correct = np.where(answered_fast, fast_correct, full_correct)
+        escalated = 1.0 - float(answered_fast.mean())
+        # The fast model always runs; the full model only for escalated images
+        latency = fast_latency + escalated * full_latency
+        report.append({
+            "threshold": threshold,
+            "fast_share": round(float(answered_fast.mean()), 4),
+            "cascade_accuracy": round(float(cascade_correct.mean()), 4),
+            "accuracy_loss": round(float(full_correct.mean() - cascade_correct.mean()), 4),
+            "images_per_second": round(1.0 / latency, 2),
+            "speedup": round(full_latency / latency, 2),
+        })
+
+    summary = {
+        "images": len(rows),
+        "fast_accuracy": round(float(fast_correct.mean()), 4),
+        "full_accuracy": round(float(full_correct.mean()), 4),
+        "fast_latency_ms": round(fast_latency * 1000, 2),
+        "full_latency_ms": round(full_latency * 1000, 2),
+    }
+    return summary, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fast", required=True, type=Path, help="Fast model (.h5), e.g. MobileNetV2")
+    parser.add_argument("--full", required=True, type=Path, help="Full model (.h5), e.g. EfficientNet")
+    parser.add_argument("--data", required=True, type=Path, help="Folder with one sub-folder of images per class")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=DEFAULT_THRESHOLDS)
+    parser.add_argument("--limit", type=int, default=None, help="Evaluate at most this many images")
+    parser.add_argument("--csv", type=Path, default=None, help="Also write the threshold table to this CSV file")
+    args = parser.parse_args()
+
+    summary, report = evaluate(args.fast, args.full, args.data, args.thresholds, args.limit)
+
+    print()
+    print(f"Images: {summary['images']}")
+    print(f"Fast model: accuracy {summary['fast_accuracy']:.2%}, {summary['fast_latency_ms']} ms/image")
+    print(f"Full model: accuracy {summary['full_accuracy']:.2%}, {summary['full_latency_ms']} ms/image")
+    print()
+    print(f"{'threshold':>9} {'fast share':>10} {'accuracy':>9} {'acc. loss':>9} {'img/s':>8} {'speedup':>7}")
+    for row in report:
+        print(
+            f"{row['threshold']:>9.2f} {row['fast_share']:>10.2%} {row['cascade_accuracy']:>9.2%} "
+            f"{row['accuracy_loss']:>9.2%} {row['images_per_second']:>8.2f} {row['speedup']:>6.2f}x"
+        )
+
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(report[0].keys()))
+            writer.writeheader()
+            writer.writerows(report)
+        print(f"\nReport saved to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Export the predictions collection straight from MongoDB to CSV, NDJSON or Parquet.
+
+Streams from a server-side cursor and writes each chunk as it is produced, so
+the whole collection can be exported with constant memory. Uses the same
+MONGODB_URI / MONGODB_DB / MONGODB_COLLECTION settings as the backend.
+
+Usage:
+    python scripts/export_history.py --format parquet --output predictions.parquet \
+        --start 2024-01-01 --end 2024-07-01 --label apple --label banana
+"""
+import argparse
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import iter_predictions  # noqa: E402
+from export import EXPORT_BATCH_SIZE, EXPORT_FORMATS, require_format, stream_export  # noqa: E402
+
+
+def _timestamp(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    # Records are stored in UTC; treat dates without an offset as UTC
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--output", type=Path, help="Output file (default: stdout; required for parquet)")
+    parser.add_argument("--start", type=_timestamp, help="Only records created at or after this ISO date/time")
+    parser.add_argument("--end", type=_timestamp, help="Only records created before this ISO date/time")
+    parser.add_argument("--label", action="append", help="Only this predicted label; repeat for several")
+    parser.add_argument("--include-images", action="store_true", help="Include image_base64 (large)")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE, help="Records per cursor batch and output chunk")
+    args = parser.parse_args()
+
+    try:
+        require_format(args.format)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.format == "parquet" and args.output is None:
+        parser.error("--output is required for parquet")
+
+    records = iter_predictions(args.start, args.end, args.label, args.include_images, batch_size=args.batch_size)
+    chunks = stream_export(records, args.format, args.include_images, args.batch_size)
+    if args.output is None:
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+        return
+
+    # Write next to the destination and rename, so an interrupted export leaves no truncated file
+    partial = args.output.with_name(args.output.name + ".partial")
+    written = 0
+    with open(partial, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+            written += len(chunk)
+    partial.replace(args.output)
+    print(f"Wrote {written / (1024 * 1024):.1f} MiB to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Show that interactive /predict latency stays flat under heavy /batch-predict load.
+
+Phase 1 measures /predict latency on an idle server. Phase 2 repeats the same
+measurement while several bulk clients keep posting large batches. Every image
+is freshly generated noise, so duplicate detection never short-circuits the model.
+
+Usage:
+    python scripts/load_test.py --url http://localhost:8000 --duration 60 \
+        --batch-clients 3 --batch-size 50
+"""
+import argparse
+import io
+import threading
+import time
+import uuid
+
+import numpy as np
+import requests
+from PIL import Image
+
+
+def _random_jpeg(rng: np.random.Generator, size=(640, 480)) -> bytes:
+    pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _interactive_latencies(url: str, duration: float, think_time: float, seed: int):
+    rng = np.random.default_rng(seed)
+    client_id = f"interactive-{uuid.uuid4().hex[:6]}"
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        image = _random_jpeg(rng)
+        started = time.perf_counter()
+        try:
+            response = requests.post(
+                f"{url}/predict",
+                files={"file": ("frame.jpg", image, "image/jpeg")},
+                headers={"X-Client-Id": client_id},
+                timeout=60,
+            )
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - started) * 1000)
+        except requests.RequestException as e:
+            errors += 1
+            print(f"/predict failed: {e}")
+        time.sleep(think_time)
+    return latencies, errors
+
+
+def _batch_client(url: str, batch_size: int, stop: threading.Event, seed: int, stats: dict, lock: threading.Lock):
+    rng = np.random.default_rng(seed)
+    client_id = f"bulk-{seed}"
+    while not stop.is_set():
+        files = [("files", (f"bulk_{i}.jpg", _random_jpeg(rng), "image/jpeg")) for i in range(batch_size)]
+        try:
+            response = requests.post(f"{url}/batch-predict", files=files, headers={"X-Client-Id": client_id}, timeout=600)
+            response.raise_for_status()
+            body = response.json()
+            with lock:
+                stats["batches"] += 1
+                stats["images"] += body["success"]
+                stats["errors"] += body["total"] - body["success"]
+        except requests.RequestException as e:
+            if not stop.is_set():
+                print(f"/batch-predict failed: {e}")
+
+
+def _summary(latencies):
+    if not latencies:
+        return "no successful requests"
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return f"n={len(latencies):4d}  p50={p50:7.1f} ms  p95={p95:7.1f} ms  p99={p99:7.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per phase")
+    parser.add_argument("--batch-clients", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--think-time", type=float, default=0.2, help="Pause between interactive requests")
+    args = parser.parse_args()
+
+    print(f"Phase 1: /predict on an idle server for {args.duration:.0f}s...")
+    idle, idle_errors = _interactive_latencies(args.url, args.duration, args.think_time, seed=1)
+
+    print(f"Phase 2: /predict with {args.batch_clients} clients posting batches of {args.batch_size}...")
+    stop = threading.Event()
+    lock = threading.Lock()
+    bulk_stats = {"batches": 0, "images": 0, "errors": 0}
+    threads = [
+        threading.Thread(target=_batch_client, args=(args.url, args.batch_size, stop, 100 + i, bulk_stats, lock), daemon=True)
+        for i in range(args.batch_clients)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(2)  # let the bulk queue fill up
+    loaded, loaded_errors = _interactive_latencies(args.url, args.duration, args.think_time, seed=2)
+    stop.set()
+
+    print()
+    print(f"idle         {_summary(idle)}  errors={idle_errors}")
+    print(f"under load   {_summary(loaded)}  errors={loaded_errors}")
+    if idle and loaded:
+        ratio = np.percentile(loaded, 99) / np.percentile(idle, 99)
+        print(f"p99 under load / idle: {ratio:.2f}x")
+    with lock:
+        print(f"bulk: {bulk_stats['batches']} batches completed, {bulk_stats['images']} images, "
+              f"{bulk_stats['errors']} shed or failed (during the measured window)")
+    try:
+        print("scheduler:", requests.get(f"{args.url}/admin/scheduler", timeout=5).json())
+    except requests.RequestException:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import queue
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+
+def _percentiles(values) -> Dict[str, Optional[float]]:
+	if not values:
+		return {"count": 0, "p50": None, "p90": None, "p99": None, "mean": None}
+	data = np.fromiter(values, dtype=np.float64)
+	p50, p90, p99 = np.percentile(data, [50, 90, 99])
+	return {
+		"count": int(data.size),
+		"p50": round(float(p50), 2),
+		"p90": round(float(p90), 2),
+		"p99": round(float(p99), 2),
+		"mean": round(float(data.mean()), 2),
+	}
+
+
+class ShadowEvaluator:
+	"""Runs a sampled fraction of live inputs through a candidate model in the background.
+
+	Primary requests only pay for a random draw and a non-blocking queue put;
+	sampled inputs are first shrunk to the candidate's input size, so the queue
+	holds small images rather than full-resolution uploads. A single worker thread runs the candidate, and only when a token-bucket budget
+	allows it and the primary model is idle (is_busy() is False), so shadow work
+	never competes with live inference. Inputs that wait longer than max_age_s
+	are dropped instead of piling up.
+	"""
+
+	def __init__(
+		self,
+		candidate,
+		sample_rate: float,
+		max_per_second: float,
+		is_busy: Callable[[], bool],
+		queue_size: int = 32,
+		max_age_s: float = 30.0,
+		window: int = 5000,
+	):
+		self.candidate = candidate
+		self.sample_rate = sample_rate
+		self.max_per_second = max_per_second
+		self.max_age_s = max_age_s
+		self._is_busy = is_busy
+		self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=queue_size)
+		self._tokens = 1.0
+		self._tokens_at = time.monotonic()
+		self._lock = threading.Lock()
+		self._primary_ms: deque = deque(maxlen=window)
+		self._shadow_ms: deque = deque(maxlen=window)
+		self._records: deque = deque(maxlen=window)
+		self._counters = {"seen": 0, "sampled": 0, "evaluated": 0, "agreed": 0, "dropped_queue_full": 0, "dropped_rate_limit": 0, "dropped_stale": 0, "errors": 0}
+		self._worker = threading.Thread(target=self._run, name="shadow-evaluator", daemon=True)
+		self._worker.start()
+
+	def _take_token(self) -> bool:
+		"""Token bucket: refill at max_per_second, burst of one."""
+		now = time.monotonic()
+		self._tokens = min(1.0, self._tokens + (now - self._tokens_at) * self.max_per_second)
+		self._tokens_at = now
+		if self._tokens >= 1.0:
+			self._tokens -= 1.0
+			return True
+		return False
+
+	def submit(self, image, primary_result: Dict[str, Any], primary_ms: float) -> bool:
+		"""Offer a served request for shadow evaluation; never blocks."""
+		with self._lock:
+			self._counters["seen"] += 1
+			if random.random() >= self.sample_rate:
+				return False
+			self._counters["sampled"] += 1
+			if not self._take_token():
+				self._counters["dropped_rate_limit"] += 1
+				return False
+		# Same resize the candidate's preprocessing would do, so its result is unchanged
+		target_size = tuple(self.candidate.target_size)
+		if image.size != target_size:
+			image = image.resize(target_size, Image.Resampling.LANCZOS)
+		try:
+			self._queue.put_nowait((time.monotonic(), image, primary_result, primary_ms))
+			return True
+		except queue.Full:
+			with self._lock:
+				self._counters["dropped_queue_full"] += 1
+			return False
+
+	def _run(self) -> None:
+		while True:
+			queued_at, image, primary_result, primary_ms = self._queue.get()
+			# Yield to live traffic: wait for the primary model to go idle
+			while self._is_busy() and time.monotonic() - queued_at < self.max_age_s:
+				time.sleep(0.005)
+			if time.monotonic() - queued_at >= self.max_age_s:
+				with self._lock:
+					self._counters["dropped_stale"] += 1
+				continue
+			try:
+				started = time.perf_counter()
+				shadow_result, _ = self.candidate.predict(image, stage_name="inference_shadow")
+				shadow_ms = (time.perf_counter() - started) * 1000
+			except Exception as e:
+				print(f"[SHADOW] Candidate prediction failed: {e}")
+				with self._lock:
+					self._counters["errors"] += 1
+				continue
+			self._record(primary_result, primary_ms, shadow_result, shadow_ms)
+
+	def _record(self, primary_result, primary_ms: float, shadow_result, shadow_ms: float) -> None:
+		agree = primary_result["label"] == shadow_result["label"]
+		with self._lock:
+			self._counters["evaluated"] += 1
+			self._counters["agreed"] += int(agree)
+			self._primary_ms.append(primary_ms)
+			self._shadow_ms.append(shadow_ms)
+			self._records.append({
+				"timestamp": datetime.now(timezone.utc).isoformat(),
+				"primary_label": primary_result["label"],
+				"primary_confidence": primary_result["confidence"],
+				"shadow_label": shadow_result["label"],
+				"shadow_confidence": shadow_result["confidence"],
+				"agree": agree,
+				"confidence_delta": round(shadow_result["confidence"] - primary_result["confidence"], 4),
+				"primary_ms": round(primary_ms, 2),
+				"shadow_ms": round(shadow_ms, 2),
+			})
+
+	def summary(self) -> Dict[str, Any]:
+		with self._lock:
+			counters = dict(self._counters)
+			primary_ms = list(self._primary_ms)
+			shadow_ms = list(self._shadow_ms)
+			deltas = [r["confidence_delta"] for r in self._records]
+		evaluated = counters["evaluated"]
+		return {
+			"candidate": self.candidate.path.name,
+			"sample_rate": self.sample_rate,
+			"max_per_second": self.max_per_second,
+			"queue_depth": self._queue.qsize(),
+			"counters": counters,
+			"top1_agreement": round(counters["agreed"] / evaluated, 4) if evaluated else None,
+			"confidence_delta": {
+				"mean": round(float(np.mean(deltas)), 4) if deltas else None,
+				"mean_abs": round(float(np.mean(np.abs(deltas))), 4) if deltas else None,
+			},
+			"latency_ms": {
+				"primary": _percentiles(primary_ms),
+				"shadow": _percentiles(shadow_ms),
+			},
+		}
+
+	def records(self) -> List[Dict[str, Any]]:
+		"""Per-request comparisons kept in the rolling window, oldest first."""
+		with self._lock:
+			return list(self._records)
@@ -0,0 +1,211 @@
+"""Resume, checksum and install paths of scripts/download_model.py against a local HTTP server.
+
+Run with:  python -m unittest discover back-end/tests
+"""
+import contextlib
+import hashlib
+import http.server
+import importlib.util
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests
+
+_SCRIPT = Path(__file__).resolve().parent.parent / "scripts" / "download_model.py"
+_spec = importlib.util.spec_from_file_location("download_model", _SCRIPT)
+download_model = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(download_model)
+
+MODEL_NAME = "fruit_classifier_mobilenetv2.h5"
+
+
+class _RangeHandler(http.server.BaseHTTPRequestHandler):
+	"""Serves files from server.root with Range, ETag and If-Range support; can drop connections mid-body."""
+
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		server = self.server
+		server.requests.append((self.path, self.headers.get("Range")))
+		server.if_ranges.append((self.path, self.headers.get("If-Range")))
+		path = server.root / self.path.lstrip("/")
+		if not path.is_file():
+			self.send_error(404)
+			return
+		data = path.read_bytes()
+		etag = f'"{hashlib.sha256(data).hexdigest()[:16]}"'
+		start = 0
+		range_header = self.headers.get("Range")
+		if_range = self.headers.get("If-Range")
+		if range_header and if_range is not None and if_range != etag:
+			# Changed since the client's partial copy: send the whole file
+			range_header = None
+		if range_header:
+			start = int(re.match(r"bytes=(\d+)-", range_header).group(1))
+			if start >= len(data):
+				self.send_response(416)
+				self.send_header("Content-Range", f"bytes */{len(data)}")
+				self.end_headers()
+				return
+			self.send_response(206)
+			self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+		else:
+			self.send_response(200)
+		body = data[start:]
+		self.send_header("ETag", etag)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		if server.drops and server.drops.get(self.path, 0) > 0:
+			# Send part of the body, then cut the connection like a flaky network would
+			server.drops[self.path] -= 1
+			self.wfile.write(body[:server.drop_after])
+			self.wfile.flush()
+			self.connection.shutdown(2)
+			return
+		self.wfile.write(body)
+
+
+class DownloadModelTest(unittest.TestCase):
+	def setUp(self):
+		self._tmp = tempfile.TemporaryDirectory()
+		tmp = Path(self._tmp.name)
+		self.served = tmp / "served"
+		self.model_dir = tmp / "model"
+		self.served.mkdir()
+
+		self.model_bytes = os.urandom(3 * download_model.CHUNK_SIZE + 12345)
+		self.labels_bytes = b"apple\nbanana\n"
+		(self.served / MODEL_NAME).write_bytes(self.model_bytes)
+		(self.served / "fruit_classifier_mobilenetv2.labels.txt").write_bytes(self.labels_bytes)
+
+		self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+		self.server.root = self.served
+		self.server.requests = []
+		self.server.if_ranges = []
+		self.server.drops = {}
+		self.server.drop_after = download_model.CHUNK_SIZE + download_model.CHUNK_SIZE // 2
+		self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+		self.session = requests.Session()
+		self.cache = download_model.ModelCache(self.model_dir / ".cache")
+		# Retries back off for seconds; the local server needs no waiting
+		patcher = mock.patch.object(download_model.time, "sleep")
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.session.close()
+		self._tmp.cleanup()
+
+	def _manifest(self, **overrides) -> Path:
+		entry = {
+			"name": MODEL_NAME,
+			"url": MODEL_NAME,
+			"sha256": hashlib.sha256(self.model_bytes).hexdigest(),
+			"size": len(self.model_bytes),
+		}
+		entry.update(overrides)
+		path = Path(self._tmp.name) / "manifest.json"
+		path.write_text(json.dumps({"files": [entry]}), encoding="utf-8")
+		return path
+
+	def _fetch(self, manifest: Path):
+		entries = download_model.load_manifest(str(manifest), self.session, self.base_url)
+		with contextlib.redirect_stdout(io.StringIO()):
+			return download_model.fetch_models(entries, self.model_dir, self.cache, self.session, retries=3)
+
+	def test_resumes_after_dropped_connection(self):
+		self.server.drops = {f"/{MODEL_NAME}": 1}
+		installed = self._fetch(self._manifest())
+
+		self.assertEqual((self.model_dir / MODEL_NAME).read_bytes(), self.model_bytes)
+		self.assertEqual((self.model_dir / "fruit_classifier_mobilenetv2.labels.txt").read_bytes(), self.labels_bytes)
+		self.assertEqual(len(installed), 2)
+		ranges = [range_header for path, range_header in self.server.requests if path == f"/{MODEL_NAME}"]
+		self.assertEqual(ranges[0], None)
+		self.assertRegex(ranges[1], r"^bytes=[1-9]\d*-$")
+		self.assertEqual(list(self.cache.partial.iterdir()), [])
+
+	def test_resume_is_conditional_on_the_etag(self):
+		self.server.drops = {f"/{MODEL_NAME}": 1}
+		self._fetch(self._manifest())
+
+		if_ranges = [if_range for path, if_range in self.server.if_ranges if path == f"/{MODEL_NAME}"]
+		self.assertEqual(if_ranges[0], None)
+		self.assertEqual(if_ranges[1], f'"{hashlib.sha256(self.model_bytes).hexdigest()[:16]}"')
+
+	def test_unverified_resume_of_a_changed_file_downloads_it_again(self):
+		url = self.base_url + MODEL_NAME
+		partial = self.cache.partial_path(hashlib.sha256(url.encode()).hexdigest())
+		# Interrupted download of an older version of the file
+		partial.write_bytes(os.urandom(download_model.CHUNK_SIZE))
+		partial.with_suffix(".validator").write_text('"older-version"', encoding="utf-8")
+
+		self._fetch(self._manifest(sha256=None))
+
+		self.assertEqual((self.model_dir / MODEL_NAME).read_bytes(), self.model_bytes)
+		self.assertEqual(list(self.cache.partial.iterdir()), [])
+
+	def test_unverified_partial_without_validator_is_not_resumed(self):
+		url = self.base_url + MODEL_NAME
+		partial = self.cache.partial_path(hashlib.sha256(url.encode()).hexdigest())
+		partial.write_bytes(os.urandom(download_model.CHUNK_SIZE))
+
+		self._fetch(self._manifest(sha256=None))
+
+		self.assertEqual((self.model_dir / MODEL_NAME).read_bytes(), self.model_bytes)
+		ranges = [range_header for path, range_header in self.server.requests if path == f"/{MODEL_NAME}"]
+		self.assertEqual(ranges, [None])
+
+	def test_cached_blob_is_not_downloaded_again(self):
+		manifest = self._manifest()
+		self._fetch(manifest)
+		(self.model_dir / MODEL_NAME).unlink()
+		self.server.requests.clear()
+
+		self._fetch(manifest)
+
+		self.assertEqual((self.model_dir / MODEL_NAME).read_bytes(), self.model_bytes)
+		self.assertNotIn(f"/{MODEL_NAME}", [path for path, _ in self.server.requests])
+
+	def test_checksum_mismatch_installs_nothing(self):
+		with self.assertRaises(download_model.ChecksumError):
+			self._fetch(self._manifest(sha256="0" * 64))
+
+		self.assertFalse((self.model_dir / MODEL_NAME).exists())
+		self.assertEqual([p.name for p in self.model_dir.iterdir()], [".cache"])
+		self.assertEqual(list(self.cache.partial.iterdir()), [])
+		self.assertEqual(list(self.cache.blobs.iterdir()), [])
+
+	def test_stale_partial_is_discarded(self):
+		sha256 = hashlib.sha256(self.model_bytes).hexdigest()
+		# Left over from an interrupted download of a different file under the same key
+		self.cache.partial_path(sha256).write_bytes(os.urandom(download_model.CHUNK_SIZE))
+
+		self._fetch(self._manifest())
+
+		self.assertEqual((self.model_dir / MODEL_NAME).read_bytes(), self.model_bytes)
+		ranges = [range_header for path, range_header in self.server.requests if path == f"/{MODEL_NAME}"]
+		self.assertEqual(ranges, [f"bytes={download_model.CHUNK_SIZE}-", None])
+
+	def test_missing_labels_file_is_skipped(self):
+		(self.served / "fruit_classifier_mobilenetv2.labels.txt").unlink()
+
+		installed = self._fetch(self._manifest())
+
+		self.assertEqual(installed, [self.model_dir / MODEL_NAME])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,234 @@
+import hashlib
+import os
+from typing import BinaryIO, Dict, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+_MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+_MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(1024 * 1024 * 1024)))
+_MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+_CHUNK_SIZE = 64 * 1024
+# /predict carries at most the model input and an original image, plus multipart headers
+_MULTIPART_OVERHEAD = 64 * 1024
+_ROUTE_LIMITS = {"/predict": 2 * _MAX_UPLOAD_BYTES + _MULTIPART_OVERHEAD}
+
+# "image" is any encoded image; "npy" and "raw" are uint8 HWC RGB tensors at the model's input size
+INPUT_FORMATS = ("image", "npy", "raw", "auto")
+_NPY_MAGIC = b"\x93NUMPY"
+
+# Make Pillow itself refuse to decode anything far beyond our pixel limit
+Image.MAX_IMAGE_PIXELS = _MAX_IMAGE_PIXELS
+
+
+class ImageUpload:
+	"""An uploaded image left in its spooled temp file, with its SHA-256 and dimensions.
+
+	The multipart parser already spools each file to disk past 1 MiB, so the image
+	is never copied into memory as a whole unless read_bytes() is called.
+	"""
+
+	def __init__(
+		self,
+		filename: Optional[str],
+		content_type: Optional[str],
+		file: BinaryIO,
+		size: int,
+		sha256: str,
+		width: int,
+		height: int,
+		input_format: str = "image",
+	):
+		self.filename = filename
+		self.content_type = content_type
+		self.size = size
+		self.sha256 = sha256
+		self.width = width
+		self.height = height
+		self.input_format = input_format
+		self._file = file
+
+	def open(self) -> BinaryIO:
+		"""Return the underlying file, rewound to the start."""
+		self._file.seek(0)
+		return self._file
+
+	def read_bytes(self) -> bytes:
+		return self.open().read()
+
+	def to_array(self) -> np.ndarray:
+		"""Load an "npy" or "raw" upload as a (height, width, 3) uint8 array."""
+		if self.input_format == "npy":
+			array = np.load(self.open(), allow_pickle=False)
+		else:
+			array = np.frombuffer(self.read_bytes(), dtype=np.uint8)
+		return array.reshape(self.height, self.width, 3)
+
+
+async def _hash_upload(file: UploadFile) -> Tuple[int, str]:
+	"""Return (size, SHA-256) of an upload, read in chunks; 413 past MAX_UPLOAD_BYTES."""
+	digest = hashlib.sha256()
+	size = 0
+	await file.seek(0)
+	while True:
+		chunk = await file.read(_CHUNK_SIZE)
+		if not chunk:
+			break
+		size += len(chunk)
+		if size > _MAX_UPLOAD_BYTES:
+			raise HTTPException(
+				status_code=413,
+				detail=f"{file.filename}: file exceeds the {_MAX_UPLOAD_BYTES} byte upload limit",
+			)
+		digest.update(chunk)
+	if size == 0:
+		raise HTTPException(status_code=400, detail=f"{file.filename}: empty file")
+	return size, digest.hexdigest()
+
+
+async def read_image_upload(file: UploadFile) -> ImageUpload:
+	"""Hash an upload in chunks and reject it early if it is too large.
+
+	Raises:
+		HTTPException: 413 if the file exceeds MAX_UPLOAD_BYTES or its header declares
+			more than MAX_IMAGE_PIXELS pixels, 400 if it is not a readable image
+	"""
+	size, sha256 = await _hash_upload(file)
+	return await _probe_image(file, size, sha256)
+
+
+async def _probe_image(file: UploadFile, size: int, sha256: str) -> ImageUpload:
+	# Image.open only parses the header, so this is cheap even for a decompression bomb
+	await file.seek(0)
+	try:
+		with Image.open(file.file) as probe:
+			width, height = probe.size
+	except Image.DecompressionBombError:
+		width, height = _MAX_IMAGE_PIXELS + 1, 1
+	except Exception:
+		raise HTTPException(status_code=400, detail=f"{file.filename}: not a valid image")
+	if width * height > _MAX_IMAGE_PIXELS:
+		raise HTTPException(
+			status_code=413,
+			detail=f"{file.filename}: image exceeds the {_MAX_IMAGE_PIXELS} pixel limit",
+		)
+
+	return ImageUpload(file.filename, file.content_type, file.file, size, sha256, width, height)
+
+
+def _npy_shape(f: BinaryIO) -> Tuple[tuple, np.dtype]:
+	"""Parse only the header of a .npy file."""
+	version = np.lib.format.read_magic(f)
+	if version == (1, 0):
+		shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+	elif version == (2, 0):
+		shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+	else:
+		raise ValueError(f"unsupported .npy version {version}")
+	return shape, dtype
+
+
+async def read_model_input_upload(file: UploadFile, input_format: str, input_shape: Tuple[int, int, int]) -> ImageUpload:
+	"""Read an upload meant to go straight into the model.
+
+	"npy" and "raw" uploads must already be uint8 RGB tensors of input_shape
+	(height, width, 3); only the .npy header or the byte count is checked here.
+	"auto" picks "npy" by its magic bytes, then "image" if the header parses,
+	then "raw". Images of any size are accepted and resized as usual.
+
+	Raises:
+		HTTPException: 413 if the file is too large, 400 if it does not match input_shape
+	"""
+	if input_format not in INPUT_FORMATS:
+		raise HTTPException(status_code=400, detail=f"Unknown input_format: {input_format}")
+	if input_format == "image":
+		return await read_image_upload(file)
+
+	input_shape = tuple(input_shape)
+	size, sha256 = await _hash_upload(file)
+	await file.seek(0)
+	head = await file.read(len(_NPY_MAGIC))
+	if input_format == "auto":
+		if head == _NPY_MAGIC:
+			input_format = "npy"
+		else:
+			try:
+				return await _probe_image(file, size, sha256)
+			except HTTPException as e:
+				if e.status_code != 400:
+					raise
+			input_format = "raw"
+
+	height, width, channels = input_shape
+	await file.seek(0)
+	if input_format == "npy":
+		try:
+			shape, dtype = _npy_shape(file.file)
+		except ValueError as e:
+			raise HTTPException(status_code=400, detail=f"{file.filename}: not a valid .npy file: {e}")
+		if dtype != np.uint8 or tuple(shape) not in (input_shape, (1, *input_shape)):
+			raise HTTPException(
+				status_code=400,
+				detail=f"{file.filename}: expected a uint8 array of shape {list(input_shape)}, got {dtype} {list(shape)}",
+			)
+	elif size != height * width * channels:
+		raise HTTPException(
+			status_code=400,
+			detail=f"{file.filename}: expected {height * width * channels} bytes of uint8 {list(input_shape)} RGB, got {size}",
+		)
+	return ImageUpload(file.filename, file.content_type, file.file, size, sha256, width, height, input_format)
+
+
+class RequestSizeLimitMiddleware:
+	"""Reject request bodies above MAX_REQUEST_BYTES before they are fully received.
+
+	Checks Content-Length up front and counts streamed bytes for chunked bodies, so
+	an oversized batch upload cannot fill the disk while being spooled. Routes with
+	a known number of files get a tighter cap derived from MAX_UPLOAD_BYTES, so a
+	single oversized /predict upload is refused before it is spooled too.
+	"""
+
+	def __init__(self, app, max_bytes: int = _MAX_REQUEST_BYTES, route_limits: Optional[Dict[str, int]] = None):
+		self.app = app
+		self.max_bytes = max_bytes
+		self.route_limits = _ROUTE_LIMITS if route_limits is None else route_limits
+
+	def _limit(self, path: str) -> int:
+		route_limit = self.route_limits.get(path, 0)
+		if route_limit > 0 and (self.max_bytes <= 0 or route_limit < self.max_bytes):
+			return route_limit
+		return self.max_bytes
+
+	async def __call__(self, scope, receive, send):
+		max_bytes = self._limit(scope.get("path", "")) if scope["type"] == "http" else 0
+		if max_bytes <= 0:
+			await self.app(scope, receive, send)
+			return
+
+		for name, value in scope.get("headers", []):
+			if name == b"content-length" and value.isdigit() and int(value) > max_bytes:
+				await self._reject(send, max_bytes)
+				return
+
+		received = 0
+
+		async def limited_receive():
+			nonlocal received
+			message = await receive()
+			if message["type"] == "http.request":
+				received += len(message.get("body", b""))
+				if received > max_bytes:
+					raise HTTPException(status_code=413, detail=f"Request body exceeds {max_bytes} bytes")
+			return message
+
+		await self.app(scope, limited_receive, send)
+
+	async def _reject(self, send, max_bytes: int):
+		body = f'{{"detail":"Request body exceeds {max_bytes} bytes"}}'.encode()
+		await send({
+			"type": "http.response.start",
+			"status": 413,
+			"headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+		})
+		await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,228 @@
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+_QUANT_SCALE = 127.0
+
+
+def quantize_embedding(embedding: np.ndarray) -> np.ndarray:
+	"""L2-normalize a float embedding and quantize it to int8 (4x smaller than float32)."""
+	vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+	norm = float(np.linalg.norm(vector))
+	if norm > 0:
+		vector = vector / norm
+	return np.clip(np.rint(vector * _QUANT_SCALE), -127, 127).astype(np.int8)
+
+
+class VectorIndex:
+	"""In-process cosine-similarity index over int8-quantized embeddings.
+
+	Up to exact_threshold vectors are searched exactly with one vectorized matrix
+	product. Past that, a coarse k-means quantizer (IVF) is trained once in the
+	background and each query only scores the vectors in its nprobe closest
+	clusters. Inserts are incremental in both modes; deletions are tombstoned
+	and dropped on save. model names the network the embeddings came from, so a
+	snapshot is never reused for another model's feature space.
+	"""
+
+	def __init__(self, exact_threshold: int = 20000, nprobe: int = 8, model: Optional[str] = None):
+		self.model = model
+		self.exact_threshold = exact_threshold
+		self.nprobe = nprobe
+		self.dim: Optional[int] = None
+		self._ids: List[str] = []
+		self._positions: dict = {}
+		self._vectors = np.zeros((0, 0), dtype=np.int8)
+		self._size = 0
+		self._centroids: Optional[np.ndarray] = None
+		self._lists: List[List[int]] = []
+		self._assignments = np.zeros(0, dtype=np.int32)
+		self._lock = threading.RLock()
+		self._training = False
+		self.last_id: Optional[str] = None
+
+	def __len__(self) -> int:
+		return len(self._positions)
+
+	@property
+	def is_approximate(self) -> bool:
+		return self._centroids is not None
+
+	def _grow(self, min_capacity: int) -> None:
+		capacity = max(min_capacity, 1024, self._vectors.shape[0] * 2)
+		vectors = np.zeros((capacity, self.dim), dtype=np.int8)
+		vectors[:self._size] = self._vectors[:self._size]
+		self._vectors = vectors
+		assignments = np.full(capacity, -1, dtype=np.int32)
+		assignments[:self._size] = self._assignments[:self._size]
+		self._assignments = assignments
+
+	def _nearest_centroids(self, vectors: np.ndarray, count: int, centroids: Optional[np.ndarray] = None) -> np.ndarray:
+		centroids = self._centroids if centroids is None else centroids
+		scores = vectors.astype(np.float32) @ centroids.T
+		if count == 1:
+			return np.argmax(scores, axis=1)[:, None]
+		count = min(count, scores.shape[1])
+		return np.argsort(-scores, axis=1)[:, :count]
+
+	def _train(self, iterations: int = 10, seed: int = 0) -> None:
+		"""Spherical k-means over a sample of the stored vectors, then assign everything.
+
+		Runs on a background thread: the k-means works on a snapshot taken under
+		the lock, so inserts and (exact) searches carry on meanwhile, and vectors
+		added during training are assigned when the quantizer is installed.
+		"""
+		try:
+			with self._lock:
+				live = np.fromiter(self._positions.values(), dtype=np.int64)
+				vectors = self._vectors
+			# Never more clusters than vectors to seed them from
+			nlist = min(max(16, int(4 * np.sqrt(len(live)))), len(live))
+			rng = np.random.default_rng(seed)
+			sample_size = min(len(live), 64 * nlist)
+			sample = vectors[rng.choice(live, sample_size, replace=False)].astype(np.float32)
+			centroids = sample[rng.choice(sample_size, nlist, replace=False)]
+			for _ in range(iterations):
+				labels = np.argmax(sample @ centroids.T, axis=1)
+				for cluster in range(nlist):
+					members = sample[labels == cluster]
+					if len(members):
+						centroids[cluster] = members.sum(axis=0)
+				centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+			# Rows are never rewritten once added, so the snapshot can be assigned unlocked
+			assignments = np.concatenate([
+				self._nearest_centroids(vectors[live[start:start + 8192]], 1, centroids)[:, 0]
+				for start in range(0, len(live), 8192)
+			])
+			with self._lock:
+				trained = set(live.tolist())
+				newer = np.fromiter(
+					(p for p in self._positions.values() if p not in trained), dtype=np.int64
+				)
+				if len(newer):
+					live = np.concatenate([live, newer])
+					assignments = np.concatenate([assignments, self._nearest_centroids(self._vectors[newer], 1, centroids)[:, 0]])
+				self._assignments[live] = assignments
+				self._lists = [[] for _ in range(nlist)]
+				for position, cluster in zip(live.tolist(), assignments.tolist()):
+					self._lists[cluster].append(position)
+				self._centroids = centroids
+			print(f"[VECTOR INDEX] Trained IVF quantizer with {nlist} clusters over {len(live)} vectors")
+		except Exception as e:
+			print(f"[VECTOR INDEX] IVF training failed, staying exact: {e}")
+		finally:
+			self._training = False
+
+	def add(self, record_id: str, vector: np.ndarray) -> None:
+		"""Insert an int8 vector (see quantize_embedding) under record_id."""
+		vector = np.asarray(vector, dtype=np.int8).reshape(-1)
+		with self._lock:
+			if record_id in self._positions:
+				return
+			if self.dim is None:
+				self.dim = vector.shape[0]
+				self._vectors = np.zeros((0, self.dim), dtype=np.int8)
+			if vector.shape[0] != self.dim:
+				raise ValueError(f"Embedding has {vector.shape[0]} dims, index expects {self.dim}")
+			if self._size >= self._vectors.shape[0]:
+				self._grow(self._size + 1)
+			position = self._size
+			self._vectors[position] = vector
+			self._ids.append(record_id)
+			self._positions[record_id] = position
+			self._size += 1
+			self.last_id = record_id if self.last_id is None or record_id > self.last_id else self.last_id
+			if self._centroids is not None:
+				cluster = int(self._nearest_centroids(vector[None, :], 1)[0, 0])
+				self._assignments[position] = cluster
+				self._lists[cluster].append(position)
+			elif len(self._positions) > self.exact_threshold and not self._training:
+				# Training takes seconds at the default threshold; keep it off the caller's request
+				self._training = True
+				threading.Thread(target=self._train, name="vector-index-train", daemon=True).start()
+
+	def remove(self, record_id: str) -> None:
+		with self._lock:
+			self._positions.pop(record_id, None)
+
+	def get(self, record_id: str) -> Optional[np.ndarray]:
+		with self._lock:
+			position = self._positions.get(record_id)
+			return None if position is None else self._vectors[position].copy()
+
+	def search(self, vector: np.ndarray, k: int = 10) -> List[Tuple[str, float]]:
+		"""Return up to k (record_id, cosine similarity) pairs, most similar first."""
+		query = np.asarray(vector, dtype=np.float32).reshape(-1) / _QUANT_SCALE
+		with self._lock:
+			if not self._positions:
+				return []
+			if self._centroids is None:
+				candidates = np.arange(self._size)
+			else:
+				clusters = self._nearest_centroids(np.asarray(vector)[None, :], self.nprobe)[0]
+				candidates = np.fromiter(
+					(p for c in clusters.tolist() for p in self._lists[c]), dtype=np.int64
+				)
+			if len(candidates) == 0:
+				return []
+			scores = (self._vectors[candidates].astype(np.float32) @ query) / _QUANT_SCALE
+			# Over-fetch so tombstoned entries do not shrink the result
+			fetch = min(len(candidates), k + (self._size - len(self._positions)))
+			top = np.argpartition(-scores, fetch - 1)[:fetch]
+			top = top[np.argsort(-scores[top])]
+			results = []
+			for idx in top.tolist():
+				record_id = self._ids[candidates[idx]]
+				if self._positions.get(record_id) != candidates[idx]:
+					continue
+				results.append((record_id, round(min(float(scores[idx]), 1.0), 4)))
+				if len(results) >= k:
+					break
+			return results
+
+	def save(self, path: Path) -> None:
+		"""Persist live vectors (and the IVF quantizer) atomically to an .npz file."""
+		with self._lock:
+			ids = list(self._positions.keys())
+			positions = np.fromiter(self._positions.values(), dtype=np.int64, count=len(ids))
+			vectors = self._vectors[positions] if self.dim is not None else np.zeros((0, 0), dtype=np.int8)
+			centroids = self._centroids if self._centroids is not None else np.zeros((0, 0), dtype=np.float32)
+			assignments = self._assignments[positions]
+			last_id = self.last_id or ""
+		path.parent.mkdir(parents=True, exist_ok=True)
+		tmp_path = path.with_name(path.name + ".tmp")
+		with open(tmp_path, "wb") as f:
+			np.savez(f, ids=np.array(ids, dtype=str), vectors=vectors, centroids=centroids, assignments=assignments, last_id=np.array(last_id), model=np.array(self.model or ""))
+		os.replace(tmp_path, path)
+
+	@classmethod
+	def load(cls, path: Path, exact_threshold: int = 20000, nprobe: int = 8) -> "VectorIndex":
+		index = cls(exact_threshold=exact_threshold, nprobe=nprobe)
+		with np.load(path, allow_pickle=False) as data:
+			ids = data["ids"].tolist()
+			vectors = data["vectors"]
+			centroids = data["centroids"]
+			assignments = data["assignments"]
+			last_id = str(data["last_id"])
+			# Snapshots written before the model name was recorded load as untagged
+			index.model = str(data["model"]) if "model" in data.files else ""
+		if ids:
+			index.dim = vectors.shape[1]
+			index._vectors = np.zeros((0, index.dim), dtype=np.int8)
+			index._grow(len(ids))
+			index._vectors[:len(ids)] = vectors
+			index._ids = ids
+			index._positions = {record_id: i for i, record_id in enumerate(ids)}
+			index._size = len(ids)
+			if centroids.size:
+				index._centroids = centroids.astype(np.float32)
+				index._assignments[:len(ids)] = assignments
+				index._lists = [[] for _ in range(len(centroids))]
+				for position, cluster in enumerate(assignments.tolist()):
+					index._lists[cluster].append(position)
+		index.last_id = last_id or None
+		index.model = index.model or None
+		return index